@@ -1,18 +1,69 @@
 """Trabalho GA - Gabriel Felipe de Pauli e Jonathan Gottschalk"""
 
+import asyncio
 import csv
+import heapq
+import json
+import mmap
 import os
+import pickle
+from array import array
+from bisect import bisect_left, bisect_right
 import platform
+import sqlite3
+import struct
+import sys
+import threading
 import time
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import accumulate, islice
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import numpy as np
+except ImportError:     # <-- numpy é opcional, só o calendário de ocupação depende dele
+    np = None
+
+@lru_cache(maxsize=4096)
+def le_data(texto):
+    """Converte um texto no formato dd-mm-YYYY em date, sem usar o strptime, e retorna None 
+    se o texto não for uma data válida. Os textos já convertidos ficam guardados no cache,
+    o que ajuda porque as mesmas datas se repetem muito nas reservas."""
+    partes = texto.split("-")
+    if len(partes) != 3:
+        return None
+    dia, mes, ano = partes
+    digitos = dia + mes + ano
+    if not (0 < len(dia) <= 2 and 0 < len(mes) <= 2 and len(ano) == 4 and digitos.isascii() and digitos.isdigit()):
+        return None
+    try:
+        return date(int(ano), int(mes), int(dia))
+    except ValueError:
+        return None
+
+def escreve_data(data):
+    """Converte uma date no texto dd-mm-YYYY, sem usar o strftime."""
+    return f"{data.day:02d}-{data.month:02d}-{data.year:04d}"
+
+class ConflitoVersao(Exception):
+    """Erro gerado quando uma Reserva ou um Quarto mudou (outra versão) desde que foi lido
+    por quem está pedindo a alteração. Quem recebe o erro deve ler de novo e tentar outra vez."""
 
 class Quarto:
     """Classe representando um Quarto"""
-    def __init__(self, numero:int, categoria, diaria=float, consumo=list):
+    __slots__ = ("__numero", "__categoria", "__diaria", "__consumo", "__total_consumo", "__versao")
+
+    def __init__(self, numero:int, categoria, diaria=float):
         self.__numero = numero
-        self.__categoria = categoria
+        self.__categoria = sys.intern(categoria)    # <-- "S", "M" e "P" compartilhados por todos os quartos
         self.__diaria = diaria
-        self.__consumo = consumo
+        self.__consumo = Counter()      # <-- codigo do produto -> quantidade consumida
+        self.__total_consumo = 0.0
+        self.__versao = 0               # <-- aumenta a cada mudança no consumo
 
     @property
     def numero(self):
@@ -28,42 +79,53 @@ class Quarto:
         return self.__diaria
     @property
     def consumo(self):
-        """Método getter - quarto.consumo"""
+        """Método getter - quarto.consumo (Counter código -> quantidade)"""
         return self.__consumo
+    @property
+    def versao(self):
+        """Método getter - quarto.versao"""
+        return self.__versao
 
-    def adiciona_consumo(self, codigo, qtd):
-        """Método que adiciona um código de produto a 
-        uma lista (consumo) x vezes quantidade passada como parâmetro"""
-        for i in range(qtd):
-            self.__consumo.append(codigo)
+    def adiciona_consumo(self, codigo, qtd, preco, versao=None):
+        """Método que soma a quantidade ao código do produto no consumo (Counter)
+        e atualiza o total do consumo com o preço unitário passado como parâmetro.
+        Se a versao lida pelo chamador for informada e o quarto já estiver em outra
+        versão, gera ConflitoVersao sem alterar o consumo."""
+        if versao is not None and versao != self.__versao:
+            raise ConflitoVersao(f"O consumo do quarto {self.__numero} foi alterado por outra operação")
+        self.__consumo[int(codigo)] += qtd
+        self.__total_consumo += preco * qtd
+        self.__versao += 1
 
     def lista_consumo(self, pousada):
         """Método que printa na tela a lista de consumo do objeto Quarto instanciado"""
-        for codigo in self.__consumo:
+        for codigo, qtd in self.__consumo.items():
             produto = pousada.encontra_produto(codigo)
-            print(f"   {produto.nome}: R${produto.preco:.2f}")
+            print(f"   {produto.nome} x{qtd}: R${produto.preco*qtd:.2f}")
 
-    def valor_total_consumo(self, pousada):
-        """Método que calcula o consumo  total, iterando (for) por todos os códigos 
-        do atributo __consumo (lista de códigos)."""
-        valor_total = 0.0
-        for codigo in self.__consumo:
-            produto = pousada.encontra_produto(codigo)
-            valor_total += produto.preco
-        return valor_total
+    def valor_total_consumo(self, pousada=None):
+        """Método que retorna o consumo total, que é mantido a cada adiciona_consumo.
+        O parâmetro pousada é mantido apenas por compatibilidade."""
+        return self.__total_consumo
 
     def limpa_consumo(self):
-        """Método que limpa o atributo consumo (lista)"""
-        self.__consumo = []
+        """Método que limpa o atributo consumo (Counter) e zera o total"""
+        self.__consumo = Counter()
+        self.__total_consumo = 0.0
+        self.__versao += 1
 
 class Reserva:
     """Classe representando uma Reserva"""
+    __slots__ = ("__cliente", "__status", "__inicio", "__fim", "__quarto", "__dias", "__valor_diarias", "__versao")
+
     def __init__(self, cliente, dia_inicio:datetime, dia_fim:datetime, status:str, quarto=Quarto):
         self.__cliente = cliente
-        self.__status = status 
-        self.__dia_inicio = dia_inicio
-        self.__dia_fim = dia_fim
+        self.__status = sys.intern(status)      # <-- "A", "I", "C" e "O" compartilhados por todas as reservas
+        self.__inicio = self.__ordinal(dia_inicio)     # <-- datas guardadas como ordinais (int)
+        self.__fim = self.__ordinal(dia_fim)
         self.__quarto = quarto
+        self.__versao = 0       # <-- aumenta a cada mudança de status, datas ou quarto
+        self.__atualiza_diarias()
 
     @property
     def cliente(self):
@@ -78,45 +140,93 @@ class Reserva:
     @property
     def dia_inicio(self):
         """Método getter - reserva.dia_inicio"""
-        return self.__dia_inicio
+        return date.fromordinal(self.__inicio)
 
     @property
     def dia_fim(self):
         """Método getter - reserva.dia_fim"""
-        return self.__dia_fim
+        return date.fromordinal(self.__fim)
+
+    @property
+    def inicio(self):
+        """Método getter - reserva.inicio (ordinal da data de início)"""
+        return self.__inicio
+
+    @property
+    def fim(self):
+        """Método getter - reserva.fim (ordinal da data de fim)"""
+        return self.__fim
 
     @property
     def quarto(self):
         """Método getter - reserva.quarto"""
         return self.__quarto
 
-    @cliente.setter
-    def cliente(self, cliente):
-        """Método setter - cliente"""
-        self.__cliente = cliente
+    @property
+    def versao(self):
+        """Método getter - reserva.versao"""
+        return self.__versao
 
-    @status.setter
-    def status(self, status):
-        """Método setter - status"""
-        self.__status = status
+    @property
+    def dias(self):
+        """Método getter - reserva.dias (quantidade de diárias, mantida ao alterar as datas)"""
+        return self.__dias
 
-    @dia_inicio.setter
-    def dia_inicio(self, dia_inicio):
-        """Método setter - dia_inicio"""
-        self.__dia_inicio = dia_inicio
+    @property
+    def valor_diarias(self):
+        """Método getter - reserva.valor_diarias (dias x diária do quarto)"""
+        return self.__valor_diarias
 
-    @dia_fim.setter
-    def dia_fim(self, dia_fim):
-        """Método setter - dia_fim"""
-        self.__dia_fim = dia_fim
+    @property
+    def valor_consumo(self):
+        """Método getter - reserva.valor_consumo (total mantido pelo quarto)"""
+        return self.__quarto.valor_total_consumo()
 
-    @quarto.setter
-    def quarto(self, quarto):
-        """Método setter - quarto"""
+    @property
+    def valor_total(self):
+        """Método getter - reserva.valor_total (diárias + consumo)"""
+        return self.__valor_diarias + self.valor_consumo
+
+    @property
+    def folio(self):
+        """Método getter - reserva.folio: dicionário com dias, diárias, consumo e total da conta"""
+        return {"dias": self.__dias,
+                "diarias": self.__valor_diarias,
+                "consumo": self.valor_consumo,
+                "total": self.valor_total}
+
+    def __ordinal(self, data):
+        """Método que converte a data para ordinal, aceitando também um ordinal já pronto."""
+        return data if isinstance(data, int) else data.toordinal()
+
+    def __atualiza_diarias(self):
+        """Método que recalcula a quantidade de dias e o valor das diárias,
+        chamado na criação da reserva e sempre que as datas ou o quarto mudam."""
+        self.__dias = 1+(self.__fim - self.__inicio)
+        self.__valor_diarias = self.__dias * self.__quarto.diaria
+
+    def _troca_status(self, status):
+        """Método de uso interno da Pousada que troca o status da reserva. Só é chamado pela
+        Pousada, que move a reserva entre os grupos de status, a agenda e o calendário junto;
+        por isso o status não tem setter (use cancela_reserva, realiza_checkin...)."""
+        self.__status = sys.intern(status)
+        self.__versao += 1
+
+    def _remarca(self, cliente, dia_inicio, dia_fim, quarto):
+        """Método de uso interno da Pousada que troca o cliente, as datas e o quarto da reserva de 
+        uma vez e recalcula as diárias. Só é chamado pela Pousada.altera_reserva, que tira a reserva 
+        dos índices antes e a devolve depois; por isso cliente, datas e quarto não têm setters."""
+        self.__cliente = cliente
+        self.__inicio = self.__ordinal(dia_inicio)
+        self.__fim = self.__ordinal(dia_fim)
         self.__quarto = quarto
+        self.__atualiza_diarias()
+        self.__versao += 1
 
 class Produto:
     """Classe representando um Produto"""
+    __slots__ = ("__codigo", "__nome", "__preco")
+
     def __init__(self, codigo:int, nome, preco=float):
         self.__codigo = codigo
         self.__nome = nome
@@ -135,19 +245,541 @@ class Produto:
         """Método getter - produto.preco"""
         return self.__preco
 
+class AgendaQuarto:
+    """Classe representando a agenda de um Quarto: as reservas que ocupam o quarto
+    (status "A" ou "I"), ordenadas pela data de início para busca binária (bisect).
+    Os dados antigos e o diário podem trazer reservas sobrepostas no mesmo quarto, então
+    a agenda guarda também o maior fim acumulado até cada posição. As tuplas da agenda nunca
+    mudam no lugar: cada inclusão ou retirada monta tuplas novas e troca todas numa única 
+    atribuição, então uma consulta sem trava sempre vê a agenda inteira de antes ou de depois."""
+    def __init__(self):
+        self.__estado = ((), (), (), ())    # <-- (inicios, fins, maior fim acumulado até a posição, reservas)
+
+    def __len__(self):
+        return len(self.__estado[3])
+
+    def adiciona(self, reserva):
+        """Método que insere a reserva na agenda mantendo a ordem pela data de início."""
+        inicios, fins, _, reservas = self.__estado
+        i = bisect_right(inicios, reserva.inicio)
+        self.__troca(inicios[:i] + (reserva.inicio,) + inicios[i:],
+                     fins[:i] + (reserva.fim,) + fins[i:],
+                     reservas[:i] + (reserva,) + reservas[i:])
+
+    def remove(self, reserva):
+        """Método que retira a reserva da agenda, retorna False se ela não estava na agenda."""
+        inicios, fins, _, reservas = self.__estado
+        i = bisect_left(inicios, reserva.inicio)
+        while i < len(inicios) and inicios[i] == reserva.inicio:
+            if reservas[i] is reserva:
+                self.__troca(inicios[:i] + inicios[i + 1:], fins[:i] + fins[i + 1:], reservas[:i] + reservas[i + 1:])
+                return True
+            i += 1
+        return False
+
+    def __troca(self, inicios, fins, reservas):
+        """Método que refaz o maior fim acumulado e publica o estado novo da agenda de uma vez."""
+        self.__estado = (inicios, fins, tuple(accumulate(fins, max)), reservas)
+
+    def esta_livre(self, inicio, fim, ignora=None):
+        """Método que verifica se nenhuma reserva da agenda ocupa algum dia entre os ordinais 
+        inicio e fim (inclusive). As reservas que podem sobrepor são as que começam até fim,
+        então basta olhar se o maior fim entre elas é anterior a inicio. A reserva ignora não 
+        conta (remarcação): se o período não estiver livre, as que começam até fim são conferidas uma a uma."""
+        inicios, fins, maiores_fins, reservas = self.__estado
+        i = bisect_right(inicios, fim)
+        if i == 0 or maiores_fins[i - 1] < inicio:
+            return True
+        if ignora is None:
+            return False
+        return all(fins[j] < inicio or reservas[j] is ignora for j in range(i))
+
+class CalendarioOcupacao:
+    """Classe representando o calendário de ocupação da pousada: uma matriz numpy
+    (quartos x dias) onde cada posição conta quantas reservas ocupam o quarto no dia.
+    Permite verificar um período de um quarto, ou de todos os quartos de uma vez,
+    com operações vetorizadas sobre as linhas da matriz. Requer numpy.
+    Como as tuplas da AgendaQuarto, a matriz publicada nunca muda no lugar: cada ocupa ou libera 
+    marca uma cópia e troca o estado inteiro numa única atribuição, então as consultas leem sem 
+    trava. Quem altera o calendário segura a trava compartilhada da Pousada."""
+    MARGEM = 366    # <-- dias extras alocados quando a matriz precisa crescer
+
+    def __init__(self, numeros_quartos, reservas=()):
+        self.__linhas = {}      # <-- numero do quarto -> linha da matriz
+        self.__numeros = []     # <-- linha da matriz -> numero do quarto
+        self.__dia_base = None  # <-- ordinal da data da coluna 0
+        self.__matriz = np.zeros((0, 0), dtype=np.uint8)
+        for numero in numeros_quartos:
+            self.__linha(numero)
+        for reserva in reservas:    # <-- a matriz ainda não foi publicada, é marcada no lugar
+            self.__marca(reserva, True)
+        self.__publica()
+
+    def __publica(self):
+        """Método que publica o estado atual para as consultas, numa única atribuição."""
+        self.__estado = (self.__linhas, self.__numeros, self.__dia_base, self.__matriz)
+
+    def __linha(self, numero):
+        """Método que retorna a linha do quarto, acrescentando uma linha vazia se for um quarto novo."""
+        linha = self.__linhas.get(numero)
+        if linha is None:
+            linha = len(self.__numeros)
+            self.__linhas = {**self.__linhas, numero: linha}
+            self.__numeros = self.__numeros + [numero]
+            vazia = np.zeros((1, self.__matriz.shape[1]), dtype=np.uint8)
+            self.__matriz = np.vstack([self.__matriz, vazia])
+        return linha
+
+    def __colunas(self, primeiro, ultimo, dia_base, matriz):
+        """Método que converte o período em ordinais (inclusive) em um intervalo de colunas 
+        [inicio, fim) recortado aos limites da matriz."""
+        if dia_base is None:
+            return 0, 0
+        inicio = max(primeiro - dia_base, 0)
+        fim = min(ultimo - dia_base + 1, matriz.shape[1])
+        return inicio, max(fim, inicio)
+
+    def __garante_periodo(self, primeiro, ultimo):
+        """Método que aumenta a matriz (com margem) para que o período caiba nas colunas."""
+        if self.__dia_base is None:
+            self.__dia_base = primeiro
+        fim_atual = self.__dia_base + self.__matriz.shape[1]
+        if primeiro >= self.__dia_base and ultimo < fim_atual:
+            return
+        nova_base = min(self.__dia_base, primeiro - self.MARGEM) if primeiro < self.__dia_base else self.__dia_base
+        novo_fim = max(fim_atual, ultimo + 1 + self.MARGEM) if ultimo >= fim_atual else fim_atual
+        nova = np.zeros((self.__matriz.shape[0], novo_fim - nova_base), dtype=np.uint8)
+        deslocamento = self.__dia_base - nova_base
+        nova[:, deslocamento:deslocamento + self.__matriz.shape[1]] = self.__matriz
+        self.__matriz = nova
+        self.__dia_base = nova_base
+
+    def __marca(self, reserva, ocupa):
+        """Método que marca (ocupa=True) ou desmarca os dias da reserva na matriz ainda não publicada."""
+        linha = self.__linha(reserva.quarto.numero)
+        if ocupa:
+            self.__garante_periodo(reserva.inicio, reserva.fim)
+        inicio, fim = self.__colunas(reserva.inicio, reserva.fim, self.__dia_base, self.__matriz)
+        if ocupa:
+            self.__matriz[linha, inicio:fim] += 1
+        else:
+            self.__matriz[linha, inicio:fim] -= 1
+
+    def __altera(self, reservas, ocupa):
+        """Método que marca as reservas numa cópia da matriz e publica a cópia."""
+        self.__matriz = self.__matriz.copy()
+        for reserva in reservas:
+            self.__marca(reserva, ocupa)
+        self.__publica()
+
+    def ocupa(self, *reservas):
+        """Método que marca os dias das reservas como ocupados na linha de cada quarto."""
+        self.__altera(reservas, True)
+
+    def libera(self, *reservas):
+        """Método que desmarca os dias das reservas na linha de cada quarto."""
+        self.__altera(reservas, False)
+
+    def esta_livre(self, numero, primeiro, ultimo):
+        """Método que verifica se o quarto não está ocupado em nenhum dia do período (ordinais)."""
+        linhas, _, dia_base, matriz = self.__estado
+        linha = linhas.get(numero)
+        if linha is None:
+            return True
+        inicio, fim = self.__colunas(primeiro, ultimo, dia_base, matriz)
+        return not matriz[linha, inicio:fim].any()
+
+    def quartos_livres(self, primeiro, ultimo):
+        """Método que retorna os números de todos os quartos livres no período inteiro (ordinais)."""
+        _, numeros, dia_base, matriz = self.__estado
+        inicio, fim = self.__colunas(primeiro, ultimo, dia_base, matriz)
+        ocupados = matriz[:, inicio:fim].any(axis=1)
+        return [numeros[linha] for linha in np.flatnonzero(~ocupados)]
+
+class Diario:
+    """Classe representando o diário (journal) de alterações da pousada: um CSV onde cada
+    operação é acrescentada no fim como uma linha. O arquivo é sincronizado no disco (fsync)
+    a cada lote de registros, ou quando sincroniza() é chamado. Cada registro já é entregue
+    ao sistema operacional (flush) no grava(), então só uma queda da máquina perde o lote pendente.
+    Cada linha começa com um número de sequência que continua crescendo depois da compactação,
+    para quem reaplica o diário saber quais registros os dados salvos já incluem.
+    O registra() só numera o registro e o põe na fila, sem tocar no arquivo, para poder ser 
+    chamado com a trava compartilhada da Pousada junto com a alteração; o grava() escreve a fila
+    depois, fora dela. A trava da fila é curta e a do arquivo fica presa durante a escrita e o 
+    fsync, assim as linhas entram no arquivo na ordem da sequência."""
+    def __init__(self, arquivo="diario.csv", lote=20, sequencia=0):
+        self.__arquivo = arquivo
+        self.__lote = lote
+        self.__sequencia = sequencia    # <-- número do último registro feito
+        self.__fila = []            # <-- registros numerados ainda não escritos no arquivo
+        self.__pendentes = 0        # <-- registros escritos e ainda não sincronizados
+        self.__total = 0            # <-- registros desde a última compactação
+        self.__f = None
+        self.__writer = None
+        self.__trava_fila = threading.Lock()
+        self.__trava_arquivo = threading.RLock()
+
+    def __len__(self):
+        return self.__total
+
+    @property
+    def sequencia(self):
+        """Método getter - diario.sequencia (número do último registro feito)"""
+        return self.__sequencia
+
+    def __abre(self):
+        """Método que abre o arquivo do diário para acrescentar registros."""
+        if self.__f is None:
+            self.__f = open(self.__arquivo, "a", newline="")
+            self.__writer = csv.writer(self.__f)
+
+    def __linhas(self):
+        """Gerador que entrega (yield) (sequência, campos) das linhas do arquivo do diário. Linhas de 
+        diários antigos, sem sequência, vêm com sequência None."""
+        if not os.path.exists(self.__arquivo):
+            return
+        with open(self.__arquivo, newline="") as f:
+            for linha in csv.reader(f):
+                if linha and linha[0].isdigit():
+                    yield int(linha[0]), linha[1:]
+                else:
+                    yield None, linha
+
+    def registros(self):
+        """Gerador que entrega (yield) (sequência, campos) das linhas já gravadas no diário, na ordem 
+        em que foram feitas. Linhas de diários antigos, sem sequência, vêm com sequência None."""
+        for sequencia, campos in self.__linhas():
+            self.__total += 1
+            if sequencia is not None:
+                self.__sequencia = max(self.__sequencia, sequencia)
+            yield sequencia, campos
+
+    def registra(self, *campos):
+        """Método que numera a operação e a coloca na fila do diário, retorna a sequência. 
+        O registro só vai para o arquivo no próximo grava()."""
+        with self.__trava_fila:
+            self.__sequencia += 1
+            self.__fila.append([self.__sequencia, *campos])
+            self.__total += 1
+            return self.__sequencia
+
+    def grava(self):
+        """Método que escreve no arquivo os registros da fila, na ordem da sequência, e sincroniza 
+        se o lote estiver completo."""
+        with self.__trava_arquivo:
+            with self.__trava_fila:
+                linhas, self.__fila = self.__fila, []
+            if not linhas:
+                return
+            self.__abre()
+            self.__writer.writerows(linhas)
+            self.__f.flush()
+            self.__pendentes += len(linhas)
+            if self.__pendentes >= self.__lote:
+                self.sincroniza()
+
+    def sincroniza(self):
+        """Método que grava no disco (flush + fsync) a fila e os registros pendentes."""
+        with self.__trava_arquivo:
+            self.grava()
+            if self.__f is not None and self.__pendentes:
+                os.fsync(self.__f.fileno())
+            self.__pendentes = 0
+
+    def trunca(self, sequencia=None):
+        """Método que esvazia o diário, usado depois que os dados foram salvos (compactação). Com a 
+        sequência dos dados salvos, mantém os registros mais novos, feitos enquanto os dados eram 
+        gravados; o arquivo novo toma o lugar do antigo de uma vez (os.replace)."""
+        with self.__trava_arquivo:
+            self.fecha()
+            restantes = [] if sequencia is None else [[numero, *campos] for numero, campos in self.__linhas()
+                                                      if numero is not None and numero > sequencia]
+            temporario = self.__arquivo + ".tmp"
+            with open(temporario, "w", newline="") as f:
+                csv.writer(f).writerows(restantes)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, self.__arquivo)
+            self.__total = len(restantes) + len(self.__fila)
+
+    def fecha(self):
+        """Método que sincroniza e fecha o arquivo do diário."""
+        with self.__trava_arquivo:
+            self.sincroniza()
+            if self.__f is not None:
+                self.__f.close()
+                self.__f = None
+                self.__writer = None
+
+class BancoSQLite:
+    """Classe representando o armazenamento da pousada num banco SQLite local (sqlite3).
+    O banco usa WAL e as datas são guardadas como ordinais. Diferente do CSV, o banco guarda 
+    também as reservas canceladas e encerradas (histórico), cada uma na sua linha identificada 
+    pelo id: um cliente pode cancelar e reservar de novo o mesmo quarto e dia sem as linhas se 
+    misturarem. As consultas de disponibilidade e de reservas são respondidas pelos índices da 
+    Pousada, que tem sempre na memória as reservas que ocupam quartos; o banco só carrega e grava
+    as linhas, por isso as reservas não têm índices no banco."""
+    TABELAS = """
+        CREATE TABLE IF NOT EXISTS quarto (numero INTEGER PRIMARY KEY, categoria TEXT, diaria REAL);
+        CREATE TABLE IF NOT EXISTS produto (codigo INTEGER PRIMARY KEY, nome TEXT, preco REAL);
+        CREATE TABLE IF NOT EXISTS consumo (quarto INTEGER, produto INTEGER, qtd INTEGER,
+                                            PRIMARY KEY (quarto, produto));
+        CREATE TABLE IF NOT EXISTS reserva (id INTEGER PRIMARY KEY, cliente TEXT, inicio INTEGER,
+                                            fim INTEGER, status TEXT, quarto INTEGER);
+        CREATE TABLE IF NOT EXISTS ponto (id INTEGER PRIMARY KEY CHECK (id = 0), sequencia INTEGER);
+    """
+
+    def __init__(self, arquivo="pousada.db"):
+        self.__conexao = sqlite3.connect(arquivo, check_same_thread=False)   # <-- a Pousada grava um salva_dados por vez
+        self.__conexao.execute("PRAGMA journal_mode=WAL")
+        self.__conexao.execute("PRAGMA synchronous=NORMAL")
+        self.__conexao.executescript(self.TABELAS)
+
+    def vazio(self):
+        """Método que verifica se o banco ainda não tem quartos gravados."""
+        return self.__conexao.execute("SELECT 1 FROM quarto LIMIT 1").fetchone() is None
+
+    def sequencia(self):
+        """Método que retorna a sequência do último registro do diário incluído no banco (0 se nenhum)."""
+        linha = self.__conexao.execute("SELECT sequencia FROM ponto WHERE id = 0").fetchone()
+        return linha[0] if linha else 0
+
+    def produtos(self):
+        """Gerador que entrega (yield) os objetos Produto gravados no banco."""
+        for codigo, nome, preco in self.__conexao.execute("SELECT codigo, nome, preco FROM produto ORDER BY codigo"):
+            yield Produto(codigo, nome, preco)
+
+    def quartos(self):
+        """Gerador que entrega (yield) os objetos Quarto e o consumo (código -> quantidade) de cada um."""
+        consumos = {}
+        for numero, codigo, qtd in self.__conexao.execute("SELECT quarto, produto, qtd FROM consumo"):
+            consumos.setdefault(numero, {})[codigo] = qtd
+        for numero, categoria, diaria in self.__conexao.execute("SELECT numero, categoria, diaria FROM quarto ORDER BY numero"):
+            yield Quarto(numero, categoria, diaria), consumos.get(numero, {})
+
+    def reservas(self, encontra_quarto):
+        """Gerador que entrega (yield) (id, Reserva) de todas as reservas gravadas, na ordem em que 
+        foram gravadas. O id da linha não muda quando a reserva é alterada."""
+        cursor = self.__conexao.execute("SELECT id, cliente, inicio, fim, status, quarto FROM reserva ORDER BY id")
+        for id_reserva, cliente, inicio, fim, status, numero in cursor:
+            yield id_reserva, Reserva(cliente, inicio, fim, status, encontra_quarto(numero))
+
+    def salva(self, quartos, reservas, produtos=None, sequencia=None):
+        """Método que grava numa única transação (upsert) apenas as linhas passadas, já copiadas dos
+        objetos: quartos como (numero, categoria, diaria, consumo), reservas como (id, cliente, 
+        inicio, fim, status, quarto), com id None para as que ainda não estão no banco, e os 
+        produtos como (codigo, nome, preco), se a lista for passada. As reservas com id são 
+        atualizadas no lugar e as outras são inseridas. Retorna os ids das reservas inseridas, na 
+        ordem em que vieram. sequencia é o último registro do diário incluído nos dados, gravado 
+        na mesma transação."""
+        novos = []
+        with self.__conexao:
+            if sequencia is not None:
+                self.__conexao.execute(
+                    "INSERT INTO ponto (id, sequencia) VALUES (0, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET sequencia = excluded.sequencia", (sequencia,))
+            if produtos is not None:
+                self.__conexao.executemany(
+                    "INSERT INTO produto (codigo, nome, preco) VALUES (?, ?, ?) "
+                    "ON CONFLICT (codigo) DO UPDATE SET nome = excluded.nome, preco = excluded.preco", produtos)
+            self.__conexao.executemany(
+                "INSERT INTO quarto (numero, categoria, diaria) VALUES (?, ?, ?) "
+                "ON CONFLICT (numero) DO UPDATE SET categoria = excluded.categoria, diaria = excluded.diaria",
+                [(numero, categoria, diaria) for numero, categoria, diaria, _ in quartos])
+            self.__conexao.executemany("DELETE FROM consumo WHERE quarto = ?",
+                                       [(numero,) for numero, _, _, _ in quartos])
+            self.__conexao.executemany(
+                "INSERT INTO consumo (quarto, produto, qtd) VALUES (?, ?, ?)",
+                [(numero, codigo, qtd) for numero, _, _, consumo in quartos for codigo, qtd in consumo.items()])
+            self.__conexao.executemany(
+                "UPDATE reserva SET cliente = ?, inicio = ?, fim = ?, status = ?, quarto = ? WHERE id = ?",
+                [(*campos, id_reserva) for id_reserva, *campos in reservas if id_reserva is not None])
+            for id_reserva, *campos in reservas:
+                if id_reserva is None:
+                    novos.append(self.__conexao.execute(
+                        "INSERT INTO reserva (cliente, inicio, fim, status, quarto) VALUES (?, ?, ?, ?, ?)",
+                        campos).lastrowid)
+        return novos
+
+    def fecha(self):
+        """Método que fecha a conexão com o banco."""
+        self.__conexao.close()
+
+class ArquivoReservas:
+    """Classe representando um arquivo de reservas com registros de tamanho fixo, lido e alterado
+    direto pelo mmap, sem criar objetos Python para cada linha. Cada registro guarda as datas como
+    ordinais, o número do quarto, o status (1 byte) e a posição do nome do cliente no arquivo de 
+    nomes (.nomes), onde cada nome aparece uma vez, precedido do seu tamanho. O arquivo tem a sua
+    própria trava, então a Pousada grava nele sem segurar a trava compartilhada."""
+    REGISTRO = struct.Struct("<iiIHcx")     # <-- inicio, fim, posição do nome, quarto, status, 1 byte livre
+    POSICAO_STATUS = 14                      # <-- byte do status dentro do registro
+    TAMANHO_NOME = struct.Struct("<H")
+
+    def __init__(self, caminho="reserva.dat"):
+        self.__caminho = caminho
+        self.__caminho_nomes = os.path.splitext(caminho)[0] + ".nomes"
+        for arquivo in [self.__caminho, self.__caminho_nomes]:
+            open(arquivo, "ab").close()     # <-- cria os arquivos vazios se ainda não existirem
+        self.__f = open(self.__caminho, "r+b")
+        self.__f_nomes = open(self.__caminho_nomes, "r+b")
+        self.__mapa = None
+        self.__mapa_nomes = None
+        self.__trava = threading.Lock()     # <-- protege os mapas, que são trocados quando o arquivo cresce
+        self.__remapeia()
+        self.__posicoes_nomes = {}      # <-- nome -> posição no arquivo de nomes
+        posicao, tamanho = 0, self.__tamanho_nomes()
+        while posicao < tamanho:
+            nome = self.nome(posicao)
+            self.__posicoes_nomes[nome] = posicao
+            posicao += self.TAMANHO_NOME.size + len(nome.encode())
+
+    def __tamanho_nomes(self):
+        """Método que retorna o tamanho atual do arquivo de nomes."""
+        return os.fstat(self.__f_nomes.fileno()).st_size
+
+    def __remapeia(self):
+        """Método que (re)cria os mapas de memória depois que os arquivos cresceram."""
+        for mapa in [self.__mapa, self.__mapa_nomes]:
+            if mapa is not None:
+                mapa.close()
+        tamanho = os.fstat(self.__f.fileno()).st_size
+        self.__mapa = mmap.mmap(self.__f.fileno(), 0) if tamanho else None
+        self.__mapa_nomes = mmap.mmap(self.__f_nomes.fileno(), 0) if self.__tamanho_nomes() else None
+
+    def __len__(self):
+        return len(self.__mapa) // self.REGISTRO.size if self.__mapa is not None else 0
+
+    def nome(self, posicao):
+        """Método que lê o nome do cliente guardado na posição do arquivo de nomes."""
+        tamanho, = self.TAMANHO_NOME.unpack_from(self.__mapa_nomes, posicao)
+        inicio = posicao + self.TAMANHO_NOME.size
+        return self.__mapa_nomes[inicio:inicio + tamanho].decode()
+
+    def le(self, linha):
+        """Método que lê um registro e retorna (cliente, dia_inicio, dia_fim, status, numero do quarto)."""
+        with self.__trava:
+            inicio, fim, posicao, numero, status = self.REGISTRO.unpack_from(self.__mapa, linha * self.REGISTRO.size)
+            return self.nome(posicao), date.fromordinal(inicio), date.fromordinal(fim), status.decode(), numero
+
+    def busca_periodo(self, dt_inicio, dt_fim, numero_quarto=None):
+        """Gerador que entrega (yield) o número das linhas cujas datas cruzam o período, 
+        lendo os registros direto do mapa de memória."""
+        if self.__mapa is None:
+            return
+        primeiro, ultimo = dt_inicio.toordinal(), dt_fim.toordinal()
+        for linha, (inicio, fim, _, numero, _) in enumerate(self.REGISTRO.iter_unpack(self.__mapa)):
+            if inicio <= ultimo and fim >= primeiro and (numero_quarto is None or numero == numero_quarto):
+                yield linha
+
+    def busca_status(self, status):
+        """Gerador que entrega (yield) o número das linhas com um dos status informados (ex.: "AI"),
+        lendo só o byte do status de cada registro."""
+        if self.__mapa is None:
+            return
+        codigos = status.encode()
+        for linha in range(len(self)):
+            if self.__mapa[linha * self.REGISTRO.size + self.POSICAO_STATUS] in codigos:
+                yield linha
+
+    def __posicao_nome(self, cliente):
+        """Método que retorna a posição do nome no arquivo de nomes, gravando o nome se for novo."""
+        posicao = self.__posicoes_nomes.get(cliente)
+        if posicao is None:
+            nome = cliente.encode()
+            posicao = self.__posicoes_nomes[cliente] = self.__tamanho_nomes()
+            self.__f_nomes.seek(0, os.SEEK_END)
+            self.__f_nomes.write(self.TAMANHO_NOME.pack(len(nome)) + nome)
+            self.__f_nomes.flush()
+            self.__remapeia()
+        return posicao
+
+    def __registro(self, reserva):
+        """Método que monta os bytes do registro da reserva."""
+        return self.REGISTRO.pack(reserva.inicio, reserva.fim, self.__posicao_nome(reserva.cliente),
+                                  reserva.quarto.numero, reserva.status.encode())
+
+    def acrescenta(self, reserva):
+        """Método que grava a reserva no fim do arquivo e retorna o número da linha."""
+        with self.__trava:
+            registro = self.__registro(reserva)
+            linha = len(self)
+            self.__f.seek(0, os.SEEK_END)
+            self.__f.write(registro)
+            self.__f.flush()
+            self.__remapeia()
+            return linha
+
+    def regrava(self, linha, reserva):
+        """Método que regrava o registro inteiro da linha no lugar (depois de a reserva ser remarcada)."""
+        with self.__trava:
+            registro = self.__registro(reserva)
+            self.__mapa[linha * self.REGISTRO.size:(linha + 1) * self.REGISTRO.size] = registro
+            self.__mapa.flush()
+
+    def altera_status(self, linha, status):
+        """Método que troca o status da linha no lugar, escrevendo um único byte."""
+        with self.__trava:
+            self.__mapa[linha * self.REGISTRO.size + self.POSICAO_STATUS] = ord(status)
+            self.__mapa.flush()
+
+    def fecha(self):
+        """Método que fecha os mapas e os arquivos."""
+        for mapa in [self.__mapa, self.__mapa_nomes]:
+            if mapa is not None:
+                mapa.close()
+        self.__f.close()
+        self.__f_nomes.close()
+
 class Pousada:
     """Classe representando uma Pousada"""
-    def __init__(self, nome, contato):
+    ARQUIVO_SNAPSHOT = "pousada.snap"
+    ARQUIVO_PONTO = "pousada.ponto"     # <-- ponto de controle da última gravação dos CSVs
+    VERSAO_SNAPSHOT = 1
+    def __init__(self, nome, contato, diretorio=""):
         self.__nome = nome
         self.__contato = contato
+        self.__diretorio = diretorio    # <-- pasta com os arquivos desta pousada ("" = pasta atual)
         self.__quartos = []
         self.__reservas = []
         self.__produtos = []
+        self.__indice_quartos = {}      # <-- numero do quarto -> objeto Quarto
+        self.__indice_produtos = {}     # <-- codigo do produto -> objeto Produto
+        self.__agendas = {}             # <-- numero do quarto -> AgendaQuarto
+        self.__indices = self.__novos_indices()
+        self.__por_status = self.__novos_status()   # <-- status -> reservas com esse status
+        self.__calendario = None        # <-- CalendarioOcupacao, ativado por ativa_calendario()
+        self.__diario = None            # <-- Diario, ativado por abre_diario()
+        self.__reaplicando = False      # <-- True enquanto o diário é reaplicado (não registra de novo)
+        self.__sequencia = 0            # <-- último registro do diário incluído nos dados salvos
+        self.__alterados = set()        # <-- arquivos CSV cujos dados mudaram desde o último carrega/salva
+        self.__quartos_alterados = {}   # <-- quartos (consumo) alterados, gravados um a um no banco
+        self.__reservas_alteradas = {}  # <-- reservas novas ou alteradas, gravadas uma a uma no banco
+        self.__ids_banco = {}           # <-- Reserva -> id da linha no banco
+        self.__banco = None             # <-- BancoSQLite, ativado por usa_banco()
+        self.__arquivo_fixo = None      # <-- ArquivoReservas, ativado por usa_arquivo_fixo()
+        self.__linhas_fixas = {}        # <-- Reserva -> linha no arquivo de tamanho fixo
+        self.__historico = None         # <-- (posições, filtro) das reservas que o carrega_dados preguiçoso deixou para depois
+        self.__carregadas = None        # <-- posições das reservas de uma carga parcial (None = carga completa)
+        self.__travas = {}              # <-- numero do quarto -> trava (RLock) das reservas e do consumo do quarto
+        self.__trava = threading.RLock()    # <-- trava curta das listas e índices (sem escrita em arquivo)
+        self.__trava_salva = threading.Lock()   # <-- um salva_dados por vez (presa antes da trava compartilhada)
+        self.__trava_historico = threading.Lock()   # <-- um carrega_historico por vez (presa antes da trava compartilhada)
 
     @property
     def reservas(self):
-        """Método getter - pousada.reservas"""
-        return self.__reservas
+        """Método getter - pousada.reservas (traz o histórico, se ainda não foi carregado).
+        Retorna uma cópia (tupla) da lista, que não muda com as reservas feitas depois. A lista só 
+        cresce no fim (com a trava compartilhada), então a cópia é feita sem trava."""
+        self.carrega_historico()
+        return tuple(self.__reservas)
+    @property
+    def reservas_ativas(self):
+        """Método getter - pousada.reservas_ativas (reservas com status "A")"""
+        return self.reservas_por_status("A")
+    @property
+    def hospedagens(self):
+        """Método getter - pousada.hospedagens (reservas com check-in, status "I")"""
+        return self.reservas_por_status("I")
     @property
     def quartos(self):
         """Método getter - pousada.quartos"""
@@ -157,82 +789,449 @@ class Pousada:
         """Método getter - pousada.nome"""
         return self.__nome
     @property
+    def diretorio(self):
+        """Método getter - pousada.diretorio"""
+        return self.__diretorio
+    @property
     def produtos(self):
         """Método getter - pousada.produtos"""
         return self.__produtos
+    @property
+    def alterados(self):
+        """Método getter - pousada.alterados (arquivos que o salva_dados vai reescrever)"""
+        return set(self.__alterados)
+
+    def __caminho(self, arquivo):
+        """Método que retorna o caminho do arquivo dentro da pasta da pousada."""
+        return os.path.join(self.__diretorio, arquivo)
+
+    def adiciona_quarto(self, quarto):
+        """Método que adiciona um Quarto à lista de quartos da pousada e ao índice por número.
+        O índice é trocado por uma cópia com o quarto novo, para ser lido sem trava."""
+        with self.__trava:
+            self.__quartos.append(quarto)
+            if quarto.numero not in self.__indice_quartos:
+                self.__indice_quartos = {**self.__indice_quartos, quarto.numero: quarto}
+            self.__alterados.add("quarto.csv")
+            self.__quartos_alterados[quarto] = None
+
+    def adiciona_produto(self, produto):
+        """Método que adiciona um Produto à lista de produtos da pousada e ao índice por código."""
+        self.__produtos.append(produto)
+        self.__indice_produtos.setdefault(produto.codigo, produto)
+        self.__alterados.add("produto.csv")
 
     def encontra_quarto(self, numero):
         """ Método que busca e retorna o objeto do tipo Quarto equivalente ao número 
         do quarto que é passado como parametro, retorna None se não encontrar."""
-        for quarto in self.__quartos:
-            if quarto.numero == int(numero):
-                return quarto
-        return None
+        return self.__indice_quartos.get(int(numero))
 
     def encontra_produto(self, codigo):
         """ Método que Busca e retorna o objeto do tipo Produto equivalente ao código 
         do produto que é passado como parametro, retorna None se não encontrar."""
-        for produto in self.__produtos:
-            if produto.codigo == int(codigo):
-                return produto
-        return None
+        return self.__indice_produtos.get(int(codigo))
+
+    def __agenda(self, quarto):
+        """Método que retorna a agenda do quarto, criando uma vazia (com a trava compartilhada) 
+        se ainda não existir."""
+        agenda = self.__agendas.get(quarto.numero)
+        if agenda is None:
+            with self.__trava:
+                agenda = self.__agendas.setdefault(quarto.numero, AgendaQuarto())
+        return agenda
+
+    def __trava_quarto(self, quarto):
+        """Método que retorna a trava do quarto, criando uma se ainda não existir. Quem precisa das 
+        duas travas pega sempre a do quarto antes da trava compartilhada, para não haver deadlock."""
+        trava = self.__travas.get(quarto.numero)
+        if trava is None:
+            with self.__trava:
+                trava = self.__travas.setdefault(quarto.numero, threading.RLock())
+        return trava
+
+    def __trava_quartos(self, quartos):
+        """Método que prende as travas de vários quartos, sempre em ordem de número para não haver
+        deadlock, e retorna o ExitStack que as solta (usado com with)."""
+        por_numero = {quarto.numero: quarto for quarto in quartos}
+        travas = ExitStack()
+        try:
+            for numero in sorted(por_numero):
+                travas.enter_context(self.__trava_quarto(por_numero[numero]))
+        except BaseException:
+            travas.close()
+            raise
+        return travas
+
+    def __adiciona_reservas(self, reservas, nova=True):
+        """Método que adiciona as reservas à lista da pousada, aos índices e à agenda do quarto das 
+        que ocupam o quarto. Cada conjunto dos índices é copiado uma única vez para o lote inteiro.
+        Reservas lidas dos arquivos (nova=False) não contam como alteração a salvar."""
+        with self.__trava:
+            if nova:
+                self.__alterados.add("reserva.csv")
+                self.__reservas_alteradas.update(dict.fromkeys(reservas))
+            por_status = {}
+            for reserva in reservas:
+                por_status.setdefault(reserva.status, []).append(reserva)
+            ocupantes = por_status.get("A", []) + por_status.get("I", [])
+            for reserva in ocupantes:   # <-- a agenda antes dos índices: uma reserva achada na consulta já ocupa o quarto
+                self.__agenda(reserva.quarto).adiciona(reserva)
+            if self.__calendario is not None and ocupantes:
+                self.__calendario.ocupa(*ocupantes)
+            self.__reservas.extend(reservas)
+            self.__indexa(reservas)
+            for status, grupo in por_status.items():
+                self.__inclui(self.__por_status, status, grupo)
+
+    def __altera_status(self, reservas, status):
+        """Método que muda o status das reservas mantendo os grupos de status e a agenda do quarto 
+        atualizados: reservas canceladas ("C") ou encerradas ("O") liberam o quarto. Quem chama 
+        segura as travas dos quartos e grava o status no arquivo fixo."""
+        with self.__trava:
+            por_status = {}
+            for reserva in reservas:
+                por_status.setdefault(reserva.status, []).append(reserva)
+            liberadas = [reserva for reserva in reservas if reserva.status in ["A","I"] and status not in ["A","I"]]
+            ocupadas = [reserva for reserva in reservas if reserva.status not in ["A","I"] and status in ["A","I"]]
+            for reserva in ocupadas:    # <-- ocupa o quarto antes de publicar o status e o libera depois
+                self.__agenda(reserva.quarto).adiciona(reserva)
+            if self.__calendario is not None and ocupadas:
+                self.__calendario.ocupa(*ocupadas)
+            for atual, grupo in por_status.items():
+                self.__retira(self.__por_status, atual, grupo)
+            for reserva in reservas:
+                reserva._troca_status(status)
+            self.__inclui(self.__por_status, status, reservas)
+            self.__alterados.add("reserva.csv")
+            self.__reservas_alteradas.update(dict.fromkeys(reservas))
+            for reserva in liberadas:
+                self.__agenda(reserva.quarto).remove(reserva)
+            if self.__calendario is not None and liberadas:
+                self.__calendario.libera(*liberadas)
+
+    def ativa_calendario(self):
+        """Método que monta o calendário de ocupação (numpy) a partir das reservas que ocupam 
+        quartos e passa a usá-lo nas consultas de disponibilidade. Retorna False se o numpy 
+        não estiver instalado, e a pousada continua usando as agendas dos quartos."""
+        if np is None:
+            return False
+        with self.__trava:
+            self.__calendario = CalendarioOcupacao([quarto.numero for quarto in self.__quartos],
+                                                   [*self.__por_status["A"], *self.__por_status["I"]])
+        return True
 
     def consulta_disponibilidade(self, dt_inicio, dt_fim, quarto):
         """ Método que verifica a disponibilidade de um quarto 
-        em um intervalo de datas específico."""
-        for reserva in self.__reservas:
-            if reserva.quarto == quarto:
-                if (reserva.dia_inicio >= dt_inicio and reserva.dia_inicio <= dt_fim) \
-                        and reserva.status in ["A","I"]:
-                    return False
-                elif (reserva.dia_fim >= dt_fim and reserva.dia_fim <= dt_fim) \
-                        and reserva.status in ["A","I"]:
-                    return False
-        return True
+        em um intervalo de datas específico. A agenda e o calendário são lidos sem trava."""
+        calendario = self.__calendario
+        if calendario is not None:
+            return calendario.esta_livre(quarto.numero, dt_inicio.toordinal(), dt_fim.toordinal())
+        return self.__agenda(quarto).esta_livre(dt_inicio.toordinal(), dt_fim.toordinal())
 
-    def consulta_reserva(self, cliente=None, dt_inicio=None, dt_fim=None, quarto=None):
-        """Método que consulta as reservas ativas baseadas em critérios opcionais: 
-        cliente, data de início, data de fim e numero do quarto."""
-        reservas_list = []
-        for reserva in self.__reservas:
-            if not cliente and not dt_inicio and not dt_fim and not quarto:
-                continue
-            elif (not cliente or cliente.lower() == reserva.cliente.lower())\
-                and (not dt_inicio or dt_inicio == reserva.dia_inicio)\
-                and (not dt_fim or dt_fim == reserva.dia_fim)\
-                and (not quarto or int(quarto) == reserva.quarto.numero)\
-                and reserva.status == "A":
-                reservas_list.append(reserva)
+    def __novos_indices(self):
+        """Método que retorna os índices secundários de reservas vazios. Cada índice liga 
+        uma chave a um dicionário usado como conjunto ordenado de reservas (reserva -> None).
+        Os conjuntos publicados nos índices e nos grupos de status nunca mudam no lugar (ver __inclui)."""
+        return {"cliente": {}, "quarto": {}, "inicio": {}}
+
+    def __novos_status(self):
+        """Método que retorna os grupos de reservas por status vazios: Ativa, check-In, 
+        Cancelada e check-Out. Cada grupo também é um conjunto ordenado (reserva -> None)."""
+        return {"A": {}, "I": {}, "C": {}, "O": {}}
+
+    def reservas_por_status(self, status):
+        """Método que retorna a lista de reservas com o status informado, sem percorrer 
+        as reservas dos outros status. O grupo publicado é copiado sem trava."""
+        if status not in ["A","I"]:
+            self.carrega_historico()
+        return list(self.__por_status.get(status, {}))
+
+    def __chaves(self, reserva):
+        """Método que retorna as chaves da reserva em cada índice secundário."""
+        return {"cliente": reserva.cliente.casefold(),
+                "quarto": reserva.quarto.numero,
+                "inicio": reserva.inicio}
+
+    def __inclui(self, grupos, chave, reservas):
+        """Método que publica em grupos[chave] (índice ou grupo de status) um conjunto novo com as 
+        reservas incluídas. Como as tuplas da AgendaQuarto, um conjunto publicado nunca muda no 
+        lugar, então as consultas percorrem os conjuntos sem trava. Chamado com a trava compartilhada."""
+        conjunto = dict(grupos.get(chave, {}))
+        conjunto.update(dict.fromkeys(reservas))
+        grupos[chave] = conjunto
+
+    def __retira(self, grupos, chave, reservas):
+        """Método que publica em grupos[chave] um conjunto novo sem as reservas, como o __inclui."""
+        conjunto = dict(grupos[chave])
+        for reserva in reservas:
+            del conjunto[reserva]
+        grupos[chave] = conjunto
+
+    def __por_chave(self, reservas):
+        """Método que agrupa as reservas pela chave de cada índice secundário: nome -> chave -> reservas."""
+        agrupadas = {nome: {} for nome in self.__indices}
+        for reserva in reservas:
+            for nome, chave in self.__chaves(reserva).items():
+                agrupadas[nome].setdefault(chave, []).append(reserva)
+        return agrupadas
+
+    def __indexa(self, reservas):
+        """Método que inclui as reservas em todos os índices secundários."""
+        for nome, por_chave in self.__por_chave(reservas).items():
+            for chave, grupo in por_chave.items():
+                self.__inclui(self.__indices[nome], chave, grupo)
+
+    def __desindexa(self, reservas):
+        """Método que retira as reservas de todos os índices secundários."""
+        for nome, por_chave in self.__por_chave(reservas).items():
+            for chave, grupo in por_chave.items():
+                self.__retira(self.__indices[nome], chave, grupo)
+                if not self.__indices[nome][chave]:
+                    del self.__indices[nome][chave]
+
+    def __planeja_consulta(self, status, cliente, dt_inicio, dt_fim, quarto):
+        """Método que responde uma consulta pelos índices: busca o conjunto de reservas de 
+        cada critério informado, percorre o menor deles (o mais seletivo) e confere se cada 
+        reserva também está nos demais. A data de fim não tem índice e é filtrada no final.
+        A passada é feita sem trava sobre os conjuntos publicados, que nunca mudam no lugar."""
+        if not cliente and not dt_inicio and not dt_fim and not quarto:
+            return None
+        if status not in ["A","I"]:
+            self.carrega_historico()
+        indices = self.__indices
+        conjuntos = [self.__por_status.get(status, {})]
+        if cliente:
+            conjuntos.append(indices["cliente"].get(cliente.casefold(), {}))
+        if dt_inicio:
+            conjuntos.append(indices["inicio"].get(dt_inicio.toordinal(), {}))
+        if quarto:
+            conjuntos.append(indices["quarto"].get(int(quarto), {}))
+        conjuntos.sort(key=len)
+        menor, outros = conjuntos[0], conjuntos[1:]
+        reservas_list = [reserva for reserva in menor
+                         if all(reserva in conjunto for conjunto in outros)
+                         and (not dt_fim or dt_fim.toordinal() == reserva.fim)]
         if reservas_list:
             return reservas_list
         else:
             return None
 
+    def consulta_quartos_livres(self, dt_inicio, dt_fim, categoria=None, diaria_min=None, diaria_max=None):
+        """Método que retorna todos os quartos disponíveis no período, opcionalmente filtrados 
+        pela categoria ("S", "M" ou "P") e por uma faixa de diária, ordenados pelo valor da diária.
+        Usa o calendário de ocupação quando ativo, senão a agenda de cada quarto. Lê sem trava o 
+        índice de quartos e o calendário publicados."""
+        inicio, fim = dt_inicio.toordinal(), dt_fim.toordinal()
+        quartos = self.__indice_quartos
+        calendario = self.__calendario
+        numeros = calendario.quartos_livres(inicio, fim) if calendario is not None else None
+        if numeros is not None:
+            candidatos = [quartos[numero] for numero in numeros if numero in quartos]
+        else:
+            candidatos = [quarto for quarto in quartos.values()
+                          if self.__agenda(quarto).esta_livre(inicio, fim)]
+        quartos_list = [quarto for quarto in candidatos
+                        if (not categoria or quarto.categoria == categoria)
+                        and (diaria_min is None or quarto.diaria >= diaria_min)
+                        and (diaria_max is None or quarto.diaria <= diaria_max)]
+        quartos_list.sort(key=lambda quarto: (quarto.diaria, quarto.numero))
+        return quartos_list
+
+    def registra_consumo(self, quarto, codigo, qtd, versao=None):
+        """Método que registra o consumo de qtd unidades do produto no quarto, 
+        retorna o Produto ou None se o código não existir. Com a versao do quarto lida 
+        pelo chamador, gera ConflitoVersao se o consumo mudou desde a leitura.
+        Gera ValueError se qtd não for maior que zero."""
+        if qtd <= 0:
+            raise ValueError("A quantidade consumida deve ser maior que zero")
+        produto = self.encontra_produto(codigo)
+        if produto is None:
+            return None
+        with self.__trava_quarto(quarto), self.__trava:
+            quarto.adiciona_consumo(produto.codigo, qtd, produto.preco, versao)
+            self.__alterados.add("quarto.csv")
+            self.__quartos_alterados[quarto] = None
+            self.__registra("consumo", quarto.numero, produto.codigo, qtd)
+        self.__grava_diario()
+        return produto
+
+    def limpa_consumo(self, quarto):
+        """Método que limpa o consumo do quarto (depois do check-out)."""
+        with self.__trava_quarto(quarto), self.__trava:
+            quarto.limpa_consumo()
+            self.__alterados.add("quarto.csv")
+            self.__quartos_alterados[quarto] = None
+            self.__registra("limpa", quarto.numero)
+        self.__grava_diario()
+
+    def consulta_reserva(self, cliente=None, dt_inicio=None, dt_fim=None, quarto=None):
+        """Método que consulta as reservas ativas baseadas em critérios opcionais: 
+        cliente, data de início, data de fim e numero do quarto."""
+        return self.__planeja_consulta("A", cliente, dt_inicio, dt_fim, quarto)
+
     def realiza_reserva(self, cliente, dt_inicio, dt_fim, quarto):
         """Método que cria e adiciona uma nova reserva à lista de reservas da pousada."""
+        reserva = self.__realiza_reserva(cliente, dt_inicio, dt_fim, quarto)
+        self.__grava_diario()
+        return reserva
+
+    def __realiza_reserva(self, cliente, dt_inicio, dt_fim, quarto):
+        """Método que cria a reserva e a inclui nas listas e índices sem escrever o diário no arquivo
+        (o lote escreve uma vez só no fim). A reserva é acrescentada no arquivo fixo só com a trava
+        do quarto presa; a trava compartilhada fica presa só para publicar a reserva."""
         reserva = Reserva(cliente, dt_inicio, dt_fim, "A", quarto)
-        self.__reservas.append(reserva)
+        with self.__trava_quarto(quarto):
+            linha = self.__arquivo_fixo.acrescenta(reserva) if self.__arquivo_fixo is not None else None
+            with self.__trava:
+                self.__adiciona_reservas([reserva])
+                if linha is not None:
+                    self.__linhas_fixas[reserva] = linha
+                self.__registra("reserva", cliente, escreve_data(dt_inicio), escreve_data(dt_fim), quarto.numero)
+        return reserva
 
-    def cancela_reserva(self, cliente):
-        """Método que muda o status das reservas de um cliente para Cancelada, dentro da 
-        lista de reservas da pousada."""
-        reservas = self.consulta_reserva(cliente)
-        if reservas:
-            for reserva in reservas:
-                reserva.status = "C"
-            return True
-        else:
+    def reserva_se_disponivel(self, cliente, dt_inicio, dt_fim, quarto):
+        """Método que verifica a disponibilidade do quarto e faz a reserva numa única operação, 
+        segurando a trava do quarto: duas threads nunca reservam o mesmo quarto no mesmo período,
+        e reservas de quartos diferentes seguem em paralelo. Retorna a Reserva, ou None se o 
+        quarto estiver ocupado no período."""
+        with self.__trava_quarto(quarto):
+            if not self.consulta_disponibilidade(dt_inicio, dt_fim, quarto):
+                return None
+            return self.realiza_reserva(cliente, dt_inicio, dt_fim, quarto)
+
+    def altera_reserva(self, reserva, cliente=None, dt_inicio=None, dt_fim=None, quarto=None, versao=None):
+        """Método que muda o cliente, as datas ou o quarto de uma reserva ativa ou com check-in, mantendo
+        os índices, a agenda e o calendário atualizados. Retorna True, ou None se a reserva 
+        não estiver ativa/com check-in ou se o quarto estiver ocupado no novo período. Com a versao lida 
+        pelo chamador, gera ConflitoVersao se a reserva mudou desde a leitura."""
+        cliente = cliente or reserva.cliente
+        dt_inicio = dt_inicio or reserva.dia_inicio
+        dt_fim = dt_fim or reserva.dia_fim
+        quarto = quarto or reserva.quarto
+        if dt_fim < dt_inicio:
             return None
+        with self.__trava_quartos([reserva.quarto, quarto]):
+            with self.__trava:
+                if versao is not None and versao != reserva.versao:
+                    raise ConflitoVersao(f"A reserva de {reserva.cliente} foi alterada por outra operação")
+                if reserva.status not in ["A","I"]:
+                    return None
+                if not self.__agenda(quarto).esta_livre(dt_inicio.toordinal(), dt_fim.toordinal(), ignora=reserva):
+                    return None
+                chave = self.__chave_lote(reserva)
+                self.__agenda(reserva.quarto).remove(reserva)
+                if self.__calendario is not None:
+                    self.__calendario.libera(reserva)
+                self.__desindexa([reserva])
+                reserva._remarca(cliente, dt_inicio, dt_fim, quarto)
+                self.__indexa([reserva])
+                self.__agenda(quarto).adiciona(reserva)
+                if self.__calendario is not None:
+                    self.__calendario.ocupa(reserva)
+                linha = self.__linhas_fixas.get(reserva)
+                self.__alterados.add("reserva.csv")
+                self.__reservas_alteradas[reserva] = None
+                self.__registra("altera", chave, cliente, escreve_data(dt_inicio), escreve_data(dt_fim), quarto.numero)
+            if linha is not None:   # <-- fora da trava compartilhada, com as travas dos quartos presas
+                self.__arquivo_fixo.regrava(linha, reserva)
+        self.__grava_diario()
+        return True
+
+    def realiza_reservas_lote(self, pedidos):
+        """Método que faz um lote de reservas de uma vez (grupos, importações de canais de venda).
+        pedidos é uma lista de (cliente, dt_inicio, dt_fim, quarto). Como no menu, cada cliente só pode 
+        ter uma reserva ativa: na ordem dos pedidos, é recusado o pedido de quem já tem reserva ativa 
+        ou já fez outro pedido no lote. Os demais são ordenados por quarto e data de início e 
+        verificados numa única passada, contra a agenda de cada quarto e contra os pedidos do lote 
+        já aceitos. Os aceitos são gravados juntos, com as travas de todos 
+        os quartos do lote presas (em ordem de número); a trava compartilhada só fica presa durante
+        a verificação e cada reserva aceita a prende de novo para ser publicada. Retorna, na ordem dos pedidos, uma lista de 
+        (Reserva, None) para os pedidos aceitos e (None, motivo) para os recusados."""
+        pedidos = list(pedidos)
+        resultados = [None] * len(pedidos)
+        validos = []    # <-- (numero do quarto, inicio, fim, posição do pedido)
+        for i, (cliente, dt_inicio, dt_fim, quarto) in enumerate(pedidos):
+            if not cliente:
+                resultados[i] = (None, "Não foi informado o nome do cliente")
+            elif quarto is None:
+                resultados[i] = (None, "Esse quarto não existe")
+            elif dt_inicio is None or dt_fim is None:
+                resultados[i] = (None, "Data inválida")
+            elif dt_fim < dt_inicio:
+                resultados[i] = (None, "Data final anterior à data inicial")
+            else:
+                validos.append((quarto.numero, dt_inicio.toordinal(), dt_fim.toordinal(), i))
+        validos.sort()
+        quartos = {numero: pedidos[i][3] for numero, _, _, i in validos}
+        with self.__trava_quartos(quartos.values()):
+            with self.__trava:
+                clientes = set()    # <-- clientes (sem diferenciar maiúsculas) com pedido no lote
+                for i in sorted(i for _, _, _, i in validos):
+                    cliente = pedidos[i][0]
+                    if cliente.casefold() in clientes or self.consulta_reserva(cliente):
+                        resultados[i] = (None, "Cliente já possui reserva ativa")
+                    clientes.add(cliente.casefold())
+                aceitos = []
+                numero_atual, ultimo_fim = None, None   # <-- fim do último pedido aceito no quarto atual
+                for numero, inicio, fim, i in validos:
+                    if resultados[i] is not None:
+                        continue
+                    if numero != numero_atual:
+                        numero_atual, ultimo_fim = numero, None
+                    if (ultimo_fim is not None and inicio <= ultimo_fim) or not self.__agenda(quartos[numero]).esta_livre(inicio, fim):
+                        resultados[i] = (None, "Quarto esta indisponivel nessa data")
+                    else:
+                        ultimo_fim = fim
+                        aceitos.append(i)
+            for i in sorted(aceitos):
+                resultados[i] = (self.__realiza_reserva(*pedidos[i]), None)
+        self.__grava_diario()
+        return resultados
 
-    def realiza_checkin(self, cliente):
-        """Método que realiza o check-in das reservas ativas de um cliente especificado."""
-        reservas = self.consulta_reserva(cliente)
-        if reservas:
+    def __troca_status(self, reservas, versoes, atual, status, registro):
+        """Método que muda o status das reservas para status como uma operação de comparar e trocar:
+        cada reserva precisa ainda estar no status atual e na versão lida pelo chamador (versoes:
+        Reserva -> versão), senão nenhuma é alterada e é gerado ConflitoVersao. As travas dos quartos
+        (em ordem de número) só ficam presas durante a verificação e a troca. O registro do diário é
+        numerado com a trava compartilhada presa junto com a troca, então um salva_dados nunca grava a 
+        troca sem a sequência do registro; o arquivo fixo e o arquivo do diário são escritos depois,
+        fora da trava compartilhada."""
+        with self.__trava_quartos(reserva.quarto for reserva in reservas):
             for reserva in reservas:
-                reserva.status = "I"
-            return True
-        else:
+                if reserva.status != atual or versoes.get(reserva) != reserva.versao:
+                    raise ConflitoVersao(f"A reserva de {reserva.cliente} foi alterada por outra operação")
+            with self.__trava:
+                self.__altera_status(reservas, status)
+                linhas = [self.__linhas_fixas[reserva] for reserva in reservas if reserva in self.__linhas_fixas]
+                self.__registra(*registro)
+            for linha in linhas:
+                self.__arquivo_fixo.altera_status(linha, status)
+        self.__grava_diario()
+
+    def __muda_status(self, cliente, versoes, atual, status, operacao):
+        """Método que muda o status das reservas do cliente que estão no status atual. Sem versoes,
+        usa as versões das reservas encontradas agora, então uma alteração feita por outra thread 
+        entre a consulta e a troca também gera ConflitoVersao. O diário guarda a chave de cada 
+        reserva trocada, para a reaplicação não trocar as outras reservas do cliente."""
+        if versoes is None:
+            reservas = self.__planeja_consulta(atual, cliente, None, None, None)
+            versoes = {reserva: reserva.versao for reserva in reservas or []}
+        if not versoes:
             return None
+        self.__troca_status(list(versoes), versoes, atual, status,
+                            (operacao, cliente, *[self.__chave_lote(reserva) for reserva in versoes]))
+        return True
+
+    def cancela_reserva(self, cliente, versoes=None):
+        """Método que muda o status das reservas de um cliente para Cancelada, dentro da 
+        lista de reservas da pousada. versoes (Reserva -> versão) limita o cancelamento às reservas 
+        mostradas ao usuário e gera ConflitoVersao se alguma delas mudou desde então."""
+        return self.__muda_status(cliente, versoes, "A", "C", "cancela")
+
+    def realiza_checkin(self, cliente, versoes=None):
+        """Método que realiza o check-in das reservas ativas de um cliente especificado,
+        com a mesma verificação de versoes do cancela_reserva."""
+        return self.__muda_status(cliente, versoes, "A", "I", "checkin")
 
     def calcula_dias(self, data_inicio, data_fim):
         """Método que calcula a quantidade total de dias entre a data de início e a data de fim."""
@@ -242,30 +1241,84 @@ class Pousada:
     def consulta_checkin(self, cliente=None, dt_inicio=None, dt_fim=None, quarto=None):
         """Método que consulta todas as reservas com status de check-in com base nos critérios 
         opcionais do cliente, data de início, data de fim e número do quarto."""
-        reservas_list = []
-        for reserva in self.__reservas:
-            if not cliente and not dt_inicio and not dt_fim and not quarto:
-                continue
-            elif (not cliente or cliente.lower() == reserva.cliente.lower())\
-                and (not dt_inicio or dt_inicio == reserva.dia_inicio)\
-                and (not dt_fim or dt_fim == reserva.dia_fim)\
-                and (not quarto or int(quarto) == reserva.quarto.numero)\
-                and reserva.status == "I":
-                reservas_list.append(reserva)
-        if reservas_list:
-            return reservas_list
-        else:
-            return None
+        return self.__planeja_consulta("I", cliente, dt_inicio, dt_fim, quarto)
 
-    def realiza_checkout(self, cliente):
-        """Método que realiza o check-out das reservas com status de check-in de um cliente"""
-        reservas = self.consulta_checkin(cliente)
-        if reservas:
-            for reserva in reservas:
-                reserva.status = "O"
-            return True
-        else:
+    def realiza_checkout(self, cliente, versoes=None):
+        """Método que realiza o check-out das reservas com status de check-in de um cliente,
+        com a mesma verificação de versoes do cancela_reserva."""
+        return self.__muda_status(cliente, versoes, "I", "O", "checkout")
+
+    def __chave_lote(self, reserva):
+        """Método que retorna a chave numero:dd-mm-YYYY que identifica a reserva no diário. Um quarto 
+        não tem duas reservas ativas ou com check-in começando no mesmo dia."""
+        return f"{reserva.quarto.numero}:{escreve_data(reserva.dia_inicio)}"
+
+    def __reservas_das_chaves(self, status, chaves):
+        """Método que busca pelos índices as reservas com o status informado a partir das chaves do diário."""
+        reservas = []
+        for chave in chaves:
+            numero, _, dia_inicio = chave.partition(":")
+            reservas.extend(self.__planeja_consulta(status, None, le_data(dia_inicio), None, numero) or [])
+        return reservas
+
+    def __versoes_das_chaves(self, status, cliente, chaves):
+        """Método que retorna as versões atuais (Reserva -> versão) das reservas do cliente com as 
+        chaves do diário, ou None para os registros antigos, sem chaves (todas as do cliente)."""
+        if not chaves:
             return None
+        return {reserva: reserva.versao for reserva in self.__reservas_das_chaves(status, chaves)
+                if reserva.cliente.casefold() == cliente.casefold()}
+
+    def __muda_status_lote(self, reservas, filtro, atual, status, operacao):
+        """Método que seleciona numa única passada pelo grupo do status atual as reservas informadas 
+        (ou todas) para as quais filtro(reserva) for verdadeiro, e muda o status de todas de uma vez,
+        com a mesma verificação de versões do __troca_status. Gera ValueError se não forem informados
+        nem as reservas nem o filtro, para uma chamada sem critérios não trocar o grupo inteiro.
+        Retorna as contas por quarto: numero do quarto -> dicionário com as reservas, dias, diárias, 
+        consumo e total, com o consumo do quarto somado uma única vez. No check-out, o consumo dos 
+        quartos é limpo depois de entrar na conta."""
+        if reservas is None and filtro is None:
+            raise ValueError("Informe as reservas ou um filtro")
+        with self.__trava:
+            grupo = self.__por_status[atual]
+            candidatas = list(grupo) if reservas is None else [reserva for reserva in reservas if reserva in grupo]
+            versoes = {reserva: reserva.versao for reserva in candidatas if filtro is None or filtro(reserva)}
+        folios = {}
+        if not versoes:
+            return folios
+        selecionadas = list(versoes)
+        with self.__trava_quartos(reserva.quarto for reserva in selecionadas):
+            self.__troca_status(selecionadas, versoes, atual, status,
+                                (operacao, *[self.__chave_lote(reserva) for reserva in selecionadas]))
+            for reserva in selecionadas:
+                folio = folios.get(reserva.quarto.numero)
+                if folio is None:
+                    consumo = reserva.valor_consumo     # <-- consumo do quarto, entra uma vez só na conta
+                    folio = folios[reserva.quarto.numero] = {"reservas": [], "dias": 0, "diarias": 0.0,
+                                                             "consumo": consumo, "total": consumo}
+                folio["reservas"].append(reserva)
+                folio["dias"] += reserva.dias
+                folio["diarias"] += reserva.valor_diarias
+                folio["total"] += reserva.valor_diarias
+            if status == "O":
+                for reserva in selecionadas:
+                    if reserva.quarto.consumo:
+                        self.limpa_consumo(reserva.quarto)
+        return folios
+
+    def realiza_checkin_lote(self, reservas=None, filtro=None):
+        """Método que realiza o check-in de várias reservas ativas de uma vez (grupos, excursões).
+        reservas é um conjunto de reservas e filtro uma função que diz se a reserva entra, ex.:
+        filtro=lambda reserva: reserva.dia_inicio == date.today() and reserva.cliente.startswith("Grupo X").
+        É preciso informar ao menos um dos dois (ValueError). Retorna as contas por quarto 
+        (numero do quarto -> conta), vazio se nenhuma reserva entrou."""
+        return self.__muda_status_lote(reservas, filtro, "A", "I", "checkin_lote")
+
+    def realiza_checkout_lote(self, reservas=None, filtro=None):
+        """Método que realiza o check-out de várias reservas com check-in de uma vez e retorna as 
+        contas por quarto, como o realiza_checkin_lote. O consumo de cada quarto é cobrado uma 
+        única vez e limpo em seguida."""
+        return self.__muda_status_lote(reservas, filtro, "I", "O", "checkout_lote")
 
     def lista_produto(self):
         """Método que lista todos os produtos do atributo (lista) __produtos"""
@@ -273,93 +1326,864 @@ class Pousada:
         for produto in self.__produtos:
             print(f"{produto.codigo}.{produto.nome}: {produto.preco}")
 
-    def deserializar(self, arquivo):
-        """Retorna uma lista com os objetos do tipo Quarto, Reserva e Produto 
-        a partir dos valores de atributo contido nos arquivos CSV de cada um."""
-        with open(arquivo) as f:
-            reader = csv.reader(f)
-            dados = list(reader)
+    def __objeto_da_linha(self, arquivo, linha):
+        """Retorna o objeto do tipo Quarto, Reserva ou Produto montado a partir de uma linha do CSV."""
         match arquivo:
             case "quarto.csv":
-                quartos_list = []
-                for linha in dados:
-                    numero = linha[0]
-                    categoria = linha[1]
-                    diaria = linha[2]
-                    consumo = [int(linha[i]) for i in range(3, len(linha))] #Loop que transforma tudo após o 3 valor em lista
-                    quarto = Quarto(int(numero), str(categoria), float(diaria), consumo)
-                    quartos_list.append(quarto)
-                return quartos_list
+                numero = linha[0]
+                categoria = linha[1]
+                diaria = linha[2]
+                quarto = Quarto(int(numero), str(categoria), float(diaria))
+                for item in linha[3:]:     # <-- consumo no formato codigo:quantidade (ou só codigo, formato antigo)
+                    codigo, _, qtd = item.partition(":")
+                    self.__carrega_consumo(quarto, {codigo: int(qtd or 1)})
+                return quarto
             case "reserva.csv":
-                reservas_list = []
-                for linha in dados:
-                    cliente, dia_inicio, dia_fim, status, numero_quarto = linha
-                    data_inicio = datetime.strptime(dia_inicio, "%d-%m-%Y").date()
-                    data_fim = datetime.strptime(dia_fim, "%d-%m-%Y").date()
-                    quarto = self.encontra_quarto(numero_quarto)
-                    reserva = Reserva(str(cliente), data_inicio, data_fim, str(status), quarto)
-                    reservas_list.append(reserva)
-                return reservas_list
+                cliente, dia_inicio, dia_fim, status, numero_quarto = linha
+                data_inicio = le_data(dia_inicio)
+                data_fim = le_data(dia_fim)
+                if data_inicio is None or data_fim is None:
+                    raise ValueError(f"Data inválida em {arquivo}: {linha}")
+                quarto = self.encontra_quarto(numero_quarto)
+                return Reserva(str(cliente), data_inicio, data_fim, str(status), quarto)
             case "produto.csv":
-                produtos_list = []
-                for linha in dados:
-                    codigo, nome, preco = linha
-                    produto = Produto(int(codigo), str(nome), float(preco))
-                    produtos_list.append(produto)
-                return produtos_list
-
-    def carrega_dados(self):
-        """Atribui os objetos Quarto, Reserva e Produto deserializados as suas listas na pousada."""
-        self.__quartos = []
-        quartos = self.deserializar("quarto.csv")
-        for obj in quartos:
-            self.__quartos.append(obj)
+                codigo, nome, preco = linha
+                return Produto(int(codigo), str(nome), float(preco))
 
-        self.__reservas = []
-        reservas = self.deserializar("reserva.csv")
-        for obj in reservas:
-            self.__reservas.append(obj)
+    def le_objetos(self, arquivo, inicio=0, fim=None, filtro=None):
+        """Gerador que lê o CSV linha a linha e entrega (yield) os objetos do tipo Quarto, Reserva 
+        ou Produto, sem carregar o arquivo inteiro na memória. Lê apenas as linhas de inicio até fim 
+        (como numa fatia) e entrega só os objetos para os quais filtro(objeto) for verdadeiro."""
+        with open(self.__caminho(arquivo)) as f:
+            for linha in islice(csv.reader(f), inicio, fim):
+                obj = self.__objeto_da_linha(arquivo, linha)
+                if filtro is None or filtro(obj):
+                    yield obj
+
+    def deserializar(self, arquivo):
+        """Retorna uma lista com os objetos do tipo Quarto, Reserva e Produto 
+        a partir dos valores de atributo contido nos arquivos CSV de cada um."""
+        return list(self.le_objetos(arquivo))
+
+    def __carrega_consumo(self, quarto, consumo):
+        """Método que coloca no quarto o consumo lido (código -> quantidade) sem registrá-lo como alteração.
+        Um código que não está nos produtos gera ValueError, como as datas inválidas: ignorar o consumo
+        faria o próximo salva_dados apagá-lo."""
+        for codigo, qtd in consumo.items():
+            produto = self.encontra_produto(codigo)
+            if produto is None:
+                raise ValueError(f"Produto inexistente no consumo do quarto {quarto.numero}: {codigo}")
+            quarto.adiciona_consumo(produto.codigo, qtd, produto.preco)
+
+    def usa_banco(self, arquivo="pousada.db"):
+        """Método que passa a carregar e salvar os dados no banco SQLite em vez dos CSVs.
+        Se o banco estiver vazio, grava nele os dados que já estão na memória, senão carrega 
+        os dados a partir dele."""
+        self.carrega_historico()    # <-- as posições do histórico são da fonte antiga
+        self.__banco = BancoSQLite(self.__caminho(arquivo))
+        if self.__banco.vazio():
+            with self.__trava:      # <-- tudo o que está na memória vai para o banco
+                self.__alterados.update(["quarto.csv", "reserva.csv", "produto.csv"])
+                self.__quartos_alterados.update(dict.fromkeys(self.__quartos))
+                self.__reservas_alteradas.update(dict.fromkeys(self.__reservas))
+            self.salva_dados()
+        else:
+            self.carrega_dados()
+        return self.__banco
+
+    def __snapshot_atual(self):
+        """Método que verifica se o snapshot existe e é mais novo que todos os CSVs."""
+        snapshot = self.__caminho(self.ARQUIVO_SNAPSHOT)
+        if not os.path.exists(snapshot):
+            return False
+        instante = os.path.getmtime(snapshot)
+        return all(not os.path.exists(caminho) or os.path.getmtime(caminho) <= instante
+                   for caminho in map(self.__caminho, ["quarto.csv", "reserva.csv", "produto.csv"]))
+
+    def __le_snapshot(self):
+        """Método que lê o snapshot binário, retorna None se ele for de outra versão."""
+        with open(self.__caminho(self.ARQUIVO_SNAPSHOT), "rb") as f:
+            dados = pickle.load(f)
+        if dados.get("versao") != self.VERSAO_SNAPSHOT:
+            return None
+        return dados
+
+    def __reservas_do_snapshot(self, dados):
+        """Gerador que monta os objetos Reserva a partir das colunas guardadas no snapshot."""
+        nomes, status = dados["nomes"], dados["status"]
+        for i, (id_cliente, inicio, fim, numero) in enumerate(zip(dados["clientes"], dados["inicios"],
+                                                                  dados["fins"], dados["numeros"])):
+            yield Reserva(nomes[id_cliente], inicio, fim,
+                          status[i], self.encontra_quarto(numero))
+
+    def salva_snapshot(self):
+        """Método que grava o estado da pousada (o mesmo conteúdo dos CSVs) num snapshot binário
+        (pickle protocolo 5), com as reservas em colunas (array) para carregar rápido. O estado é 
+        copiado com a trava compartilhada e gravado fora dela."""
+        with self.__trava:
+            dados = self.__dados_snapshot()
+        self.__grava_snapshot(dados)
+
+    def __dados_snapshot(self):
+        """Método que copia o estado da pousada nas colunas do snapshot. Chamado com a trava compartilhada."""
+        nomes, ids = [], {}
+        clientes, inicios, fins, numeros = array("I"), array("i"), array("i"), array("h")
+        status = []
+        for reserva in self.__reservas:
+            if reserva.status in ["C","O"]:
+                continue
+            if reserva.cliente not in ids:
+                ids[reserva.cliente] = len(nomes)
+                nomes.append(reserva.cliente)
+            clientes.append(ids[reserva.cliente])
+            inicios.append(reserva.inicio)
+            fins.append(reserva.fim)
+            numeros.append(reserva.quarto.numero)
+            status.append(reserva.status)
+        return {"versao": self.VERSAO_SNAPSHOT,
+                "produtos": [(produto.codigo, produto.nome, produto.preco) for produto in self.__produtos],
+                "quartos": [(quarto.numero, quarto.categoria, quarto.diaria, dict(quarto.consumo))
+                            for quarto in self.__quartos],
+                "nomes": nomes, "clientes": clientes, "inicios": inicios, "fins": fins,
+                "numeros": numeros, "status": "".join(status)}
+
+    def __grava_snapshot(self, dados):
+        """Método que grava os dados do snapshot num temporário e o troca pelo snapshot (os.replace)."""
+        snapshot = self.__caminho(self.ARQUIVO_SNAPSHOT)
+        temporario = snapshot + ".tmp"
+        with open(temporario, "wb") as f:
+            pickle.dump(dados, f, protocol=5)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, snapshot)
+
+    def usa_arquivo_fixo(self, caminho="reserva.dat"):
+        """Método que passa a guardar as reservas no arquivo de registros de tamanho fixo: reservas
+        novas são acrescentadas no fim e as mudanças de status escrevem um byte no lugar, então o 
+        salva_dados não reescreve mais o reserva.csv. Se o arquivo estiver vazio, grava nele as 
+        reservas que já estão na memória e salva os dados com a sequência do diário, para as
+        reservas reaplicadas do diário não serem reaplicadas de novo por cima do arquivo; senão 
+        carrega as reservas a partir dele."""
+        self.carrega_historico()    # <-- as posições do histórico são da fonte antiga
+        self.__arquivo_fixo = ArquivoReservas(self.__caminho(caminho))
+        if len(self.__arquivo_fixo) == 0:
+            reservas = tuple(self.__reservas)
+            linhas = [self.__arquivo_fixo.acrescenta(reserva) for reserva in reservas]
+            with self.__trava:
+                self.__linhas_fixas.update(zip(reservas, linhas))
+            self.salva_dados()
+        else:
+            self.carrega_dados()
+        return self.__arquivo_fixo
+
+    def __reservas_do_arquivo_fixo(self, linhas):
+        """Gerador que monta (linha, Reserva) só para as linhas informadas do arquivo de tamanho fixo."""
+        for linha in linhas:
+            cliente, data_inicio, data_fim, status, numero_quarto = self.__arquivo_fixo.le(linha)
+            yield linha, Reserva(cliente, data_inicio, data_fim, status, self.encontra_quarto(numero_quarto))
+
+    def __adiciona_carregadas(self, itens):
+        """Método que adiciona de uma vez as reservas lidas da fonte (lista de (posição, Reserva)), 
+        lembrando a linha das que vêm do arquivo de tamanho fixo para as mudanças de status e o id 
+        das que vêm do banco."""
+        with self.__trava:
+            self.__adiciona_reservas([reserva for _, reserva in itens], nova=False)
+            if self.__arquivo_fixo is not None:
+                self.__linhas_fixas.update((reserva, posicao) for posicao, reserva in itens)
+            elif self.__banco is not None:
+                self.__ids_banco.update((reserva, posicao) for posicao, reserva in itens)
+
+    def __fontes(self):
+        """Método que escolhe de onde os dados serão carregados (banco, snapshot ou CSVs) e retorna
+        os iteradores de produtos, de quartos (com o consumo de cada um) e de reservas. As reservas
+        vêm como (posição, Reserva): o id no banco, a linha do arquivo ou a posição no snapshot.
+        Com o arquivo de tamanho fixo em uso, as reservas vêm sempre dele."""
+        if self.__banco is not None:
+            fontes = (self.__banco.produtos(), self.__banco.quartos(),
+                      self.__banco.reservas(self.encontra_quarto))
+        else:
+            dados = self.__le_snapshot() if self.__snapshot_atual() else None
+            if dados is not None:
+                fontes = ((Produto(*campos) for campos in dados["produtos"]),
+                          ((Quarto(numero, categoria, diaria), consumo) for numero, categoria, diaria, consumo in dados["quartos"]),
+                          enumerate(self.__reservas_do_snapshot(dados)))
+            else:
+                fontes = (self.le_objetos("produto.csv"),
+                          ((obj, {}) for obj in self.le_objetos("quarto.csv")),
+                          enumerate(self.le_objetos("reserva.csv")))
+        if self.__arquivo_fixo is not None:
+            fontes = (fontes[0], fontes[1], self.__reservas_do_arquivo_fixo(range(len(self.__arquivo_fixo))))
+        return fontes
+
+    def __eh_atual(self, reserva, hoje):
+        """Método que verifica se a reserva faz parte do conjunto usado no dia a dia:
+        ativa, com check-in ou que ainda não terminou (hoje é o ordinal da data atual)."""
+        return reserva.status in ["A","I"] or reserva.fim >= hoje
+
+    def carrega_historico(self):
+        """Método que carrega as reservas antigas deixadas de fora por um carrega_dados preguiçoso.
+        São lidas só as posições guardadas na carga, sem olhar o status que a reserva tem agora na 
+        fonte: uma reserva que já está na memória e foi cancelada ou encerrada depois não volta 
+        repetida. Retorna a quantidade de reservas carregadas (0 se o histórico já estava carregado).
+        A fonte é lida com a trava do histórico, fora da trava compartilhada: o salva_dados não 
+        reescreve o reserva.csv enquanto houver histórico pendente."""
+        if self.__historico is None:
+            return 0
+        with self.__trava_historico:
+            if self.__historico is None:    # <-- outra thread carregou enquanto esta esperava a trava
+                return 0
+            pendentes, filtro = self.__historico
+            if self.__arquivo_fixo is not None:     # <-- lê direto as linhas guardadas
+                fonte = self.__reservas_do_arquivo_fixo(sorted(pendentes))
+            else:
+                fonte = (item for item in self.__fontes()[2] if item[0] in pendentes) if pendentes else ()
+            itens, lidas = [], 0
+            for posicao, obj in fonte:
+                if filtro is None or filtro(obj):
+                    itens.append((posicao, obj))
+                lidas += 1
+                if lidas == len(pendentes):
+                    break
+            with self.__trava:
+                self.__adiciona_carregadas(itens)
+                self.__historico = None
+        return len(itens)
+
+    def carrega_dados(self, filtro=None, inicio=0, fim=None, preguicoso=False):
+        """Atribui os objetos Quarto, Reserva e Produto deserializados as suas listas na pousada.
+        Os objetos vão direto do banco (se usa_banco foi chamado), do snapshot binário (se for mais 
+        novo que os CSVs) ou dos arquivos CSV para as listas e índices. Os parâmetros opcionais 
+        limitam quais reservas do histórico são carregadas, ex.: filtro=lambda reserva: reserva.fim >= hoje.
+        As reservas ativas ou com check-in entram sempre, mesmo fora do filtro ou da faixa, porque 
+        ocupam o quarto: sem elas na agenda uma reserva nova por cima seria aceita e salva.
+        Numa carga parcial (com filtro ou faixa) a pousada guarda a posição das reservas carregadas, 
+        para o salva_dados manter no reserva.csv as que ficaram de fora.
+        Com preguicoso=True só ficam na memória as reservas atuais (ativas, com check-in ou futuras);
+        o histórico é carregado por carrega_historico quando alguma consulta precisar dele. Com o 
+        arquivo de tamanho fixo, as linhas atuais são escolhidas direto no mapa de memória e só elas
+        viram objetos."""
+        self.__sequencia = self.__banco.sequencia() if self.__banco is not None else self.__le_ponto()
+        produtos, quartos, reservas = self.__fontes()
 
         self.__produtos = []
-        produtos = self.deserializar("produto.csv")
-        for obj in produtos:
-            self.__produtos.append(obj)
+        self.__indice_produtos = {}
+        for obj in produtos:        # <-- produtos primeiro, o consumo dos quartos usa os preços
+            self.adiciona_produto(obj)
+
+        self.__quartos = []
+        self.__indice_quartos = {}
+        for obj, consumo in quartos:
+            self.__carrega_consumo(obj, consumo)
+            self.adiciona_quarto(obj)
+
+        self.__reservas = []
+        self.__agendas = {}
+        self.__indices = self.__novos_indices()
+        self.__por_status = self.__novos_status()
+        self.__linhas_fixas = {}
+        self.__ids_banco = {}
+        usa_calendario = self.__calendario is not None
+        self.__calendario = None
+        hoje = date.today().toordinal()
+        parcial = filtro is not None or inicio or fim is not None
+        self.__carregadas = set() if parcial else None
+        pendentes = set()
+        if self.__arquivo_fixo is not None:
+            faixa = range(len(self.__arquivo_fixo))[inicio:fim]
+            ocupadas = set(self.__arquivo_fixo.busca_status("AI")) if parcial or preguicoso else set()
+            linhas = sorted(ocupadas.union(faixa)) if parcial else faixa
+            if preguicoso:
+                atuais = ocupadas.union(self.__arquivo_fixo.busca_periodo(date.fromordinal(hoje), date.max))
+                pendentes = {linha for linha in linhas if linha not in atuais}  # <-- o filtro vale no carrega_historico
+                linhas = [linha for linha in linhas if linha in atuais]
+            reservas = ((posicao, posicao, obj) for posicao, obj in self.__reservas_do_arquivo_fixo(linhas))
+        else:
+            faixa = range(inicio, sys.maxsize if fim is None else fim)     # <-- sem islice: as ocupadas de fora da faixa também entram
+            reservas = ((indice, posicao, obj) for indice, (posicao, obj) in enumerate(reservas))
+        itens = []
+        for indice, posicao, obj in reservas:
+            if obj.status in ["A","I"] or (indice in faixa and (filtro is None or filtro(obj))):
+                if not preguicoso or self.__eh_atual(obj, hoje):
+                    itens.append((posicao, obj))
+                else:
+                    pendentes.add(posicao)
+                if parcial:
+                    self.__carregadas.add(posicao)  # <-- as do histórico também, entram antes de salvar
+        self.__adiciona_carregadas(itens)
+        self.__historico = (pendentes, filtro) if preguicoso else None
+        if usa_calendario:
+            self.ativa_calendario()     # <-- remonta o calendário de uma vez, com as reservas novas
+        self.__alterados = set()        # <-- o que está na memória é igual aos arquivos
+        self.__quartos_alterados = {}
+        self.__reservas_alteradas = {}
 
     def serializar(self, arquivo):
-        """Retorna uma matriz com os valores dos atributos de objetos do tipo Quarto, e Reserva."""
-        match arquivo:
-            case "quarto.csv":
-                quartos_list = []
-                for quarto in self.__quartos:
-                    linha = [quarto.numero, quarto.categoria, quarto.diaria]
-                    for consumo in quarto.consumo:      # <-- Loop para serializar a lista de consumo que está no objeto quarto
-                        linha.append(consumo)
-                    quartos_list.append(linha)
-                return quartos_list
-            case "reserva.csv":
-                reservas_list = []
-                for reserva in self.__reservas:
-                    data_inicio = reserva.dia_inicio.strftime("%d-%m-%Y")
-                    data_fim = reserva.dia_fim.strftime("%d-%m-%Y")
-                    linha = [reserva.cliente, data_inicio, data_fim, reserva.status, reserva.quarto.numero]
-                    reservas_list.append(linha)
-                    return reservas_list
+        """Retorna uma matriz com os valores dos atributos de objetos do tipo Quarto, Reserva e Produto,
+        lidos com a trava compartilhada."""
+        with self.__trava:
+            match arquivo:
+                case "quarto.csv":
+                    quartos_list = []
+                    for quarto in self.__quartos:
+                        linha = [quarto.numero, quarto.categoria, quarto.diaria]
+                        for codigo, qtd in quarto.consumo.items():      # <-- Loop para serializar o consumo que está no objeto quarto
+                            linha.append(f"{codigo}:{qtd}")
+                        quartos_list.append(linha)
+                    return quartos_list
+                case "reserva.csv":
+                    return [self.__linha_reserva(reserva) for reserva in self.__reservas]
+                case "produto.csv":
+                    return [[produto.codigo, produto.nome, produto.preco] for produto in self.__produtos]
 
-    def salva_dados(self):
-        """Escreve os atributos dos objetos Quarto e Resserva serializados nos seus arquivos CSV"""
-        quartos = self.serializar("quarto.csv")
-        with open("quarto.csv", "w", newline="") as f:
+    def __linha_reserva(self, reserva):
+        """Retorna a linha do reserva.csv com os atributos da reserva."""
+        return [reserva.cliente, escreve_data(reserva.dia_inicio), escreve_data(reserva.dia_fim),
+                reserva.status, reserva.quarto.numero]
+
+    def __reservas_fora_da_carga(self, carregadas):
+        """Método que relê a fonte das reservas e retorna as linhas das reservas ativas ou com 
+        check-in que uma carga parcial deixou fora da memória (fora das posições carregadas)."""
+        return [self.__linha_reserva(reserva) for posicao, reserva in self.__fontes()[2]
+                if posicao not in carregadas and reserva.status not in ["C","O"]]
+
+    def __escreve_csv(self, arquivo, linhas):
+        """Escreve as linhas num arquivo temporário e força a gravação no disco. Retorna o nome do 
+        temporário, que só toma o lugar do arquivo em __grava_arquivos, assim uma queda no meio da 
+        escrita nunca deixa o CSV pela metade."""
+        temporario = f"{arquivo}.{os.getpid()}-{time.time_ns()}.tmp"
+        with open(self.__caminho(temporario), "w", newline="") as f:
             writer = csv.writer(f)
-            writer.writerows(quartos)
+            writer.writerows(linhas)
+            f.flush()
+            os.fsync(f.fileno())
+        return temporario
 
-        reservas = self.serializar("reserva.csv")
-        reservas_ativas = []
-        for reserva in reservas:
-            if reserva[3] not in ["C","O"]:
-                reservas_ativas.append(reserva)
-        with open("reserva.csv", "w", newline="") as f:
+    def __grava_arquivos(self, temporarios, sequencia):
+        """Método que troca os arquivos pelos temporários (arquivo -> temporário) como uma única 
+        gravação: primeiro o ponto de controle é gravado (os.replace atômico) com a sequência do 
+        diário incluída nos dados e a lista dos temporários, depois cada temporário toma o lugar do 
+        seu arquivo. Se a máquina cair no meio das trocas, __le_ponto termina o serviço na próxima carga."""
+        ponto = self.__caminho(self.ARQUIVO_PONTO)
+        with open(ponto + ".tmp", "w", newline="") as f:
             writer = csv.writer(f)
-            writer.writerows(reservas_ativas)
+            writer.writerow([sequencia])
+            writer.writerows(temporarios.items())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ponto + ".tmp", ponto)
+        for arquivo, temporario in temporarios.items():
+            os.replace(self.__caminho(temporario), self.__caminho(arquivo))
+
+    def __le_ponto(self):
+        """Método que lê o ponto de controle da última gravação dos CSVs, termina as trocas de 
+        arquivos que ela deixou pela metade e retorna a sequência do diário incluída nos arquivos."""
+        ponto = self.__caminho(self.ARQUIVO_PONTO)
+        if not os.path.exists(ponto):
+            return 0
+        with open(ponto, newline="") as f:
+            sequencia, *trocas = csv.reader(f)
+        for arquivo, temporario in trocas:
+            if os.path.exists(self.__caminho(temporario)):
+                os.replace(self.__caminho(temporario), self.__caminho(arquivo))
+        return int(sequencia[0])
+
+    def __sequencia_atual(self):
+        """Método que retorna o último registro do diário incluído no estado da memória."""
+        return self.__diario.sequencia if self.__diario is not None else self.__sequencia
+
+    def salva_dados(self):
+        """Escreve os atributos dos objetos Quarto, Reserva e Produto serializados nos seus arquivos CSV,
+        apenas dos arquivos cujos dados foram alterados. Usando o banco, grava só as linhas alteradas.
+        Junto com os dados vai a sequência do último registro do diário que eles incluem, para o 
+        abre_diario não reaplicar de novo esses registros. Depois de uma carga parcial, o reserva.csv 
+        é reescrito com as reservas que ficaram fora da memória mais as carregadas, e o snapshot não 
+        é gravado. O estado e a sequência são copiados juntos com a trava compartilhada, e os arquivos
+        (ou o banco) são gravados fora dela, um salva_dados por vez; as alterações feitas durante a 
+        gravação ficam para o próximo. Se a gravação falhar, as alterações copiadas voltam a ficar pendentes."""
+        with self.__trava_salva:
+            while True:
+                with self.__trava:
+                    if (self.__banco is None and self.__arquivo_fixo is None and self.__alterados
+                            and self.__historico is not None):
+                        historico = True    # <-- as posições do histórico mudam com o reserva.csv e o snapshot novos
+                    else:
+                        historico = False
+                        sequencia = self.__sequencia_atual()
+                        alterados, self.__alterados = self.__alterados, set()
+                        quartos_alterados, self.__quartos_alterados = self.__quartos_alterados, {}
+                        reservas_alteradas, self.__reservas_alteradas = self.__reservas_alteradas, {}
+                        copia = self.__copia_alteracoes(alterados, quartos_alterados, reservas_alteradas)
+                if not historico:
+                    break
+                self.carrega_historico()
+            try:
+                if self.__banco is not None:
+                    self.__grava_banco(sequencia, *copia)
+                else:
+                    self.__grava_csv(sequencia, *copia)
+            except BaseException:
+                with self.__trava:
+                    self.__alterados.update(alterados)
+                    self.__quartos_alterados = {**quartos_alterados, **self.__quartos_alterados}
+                    self.__reservas_alteradas = {**reservas_alteradas, **self.__reservas_alteradas}
+                raise
+            self.__sequencia = sequencia
+
+    def __copia_alteracoes(self, alterados, quartos_alterados, reservas_alteradas):
+        """Método que copia os dados alterados que o salva_dados vai gravar. Chamado com a trava 
+        compartilhada. Para o banco, retorna as linhas dos quartos, das reservas (com o id, ou None 
+        se a reserva é nova) e dos produtos; para os CSVs, as linhas de cada arquivo alterado, as 
+        posições da carga parcial e os dados do snapshot."""
+        if self.__banco is not None:
+            reservas = list(reservas_alteradas)
+            return ([(quarto.numero, quarto.categoria, quarto.diaria, dict(quarto.consumo)) for quarto in quartos_alterados],
+                    reservas,
+                    [(self.__ids_banco.get(reserva), reserva.cliente, reserva.inicio, reserva.fim, reserva.status,
+                      reserva.quarto.numero) for reserva in reservas],
+                    [(produto.codigo, produto.nome, produto.preco) for produto in self.__produtos]
+                    if "produto.csv" in alterados else None)
+        if self.__arquivo_fixo is not None:
+            alterados.discard("reserva.csv")     # <-- as reservas já estão gravadas no arquivo fixo
+        linhas = {arquivo: self.serializar(arquivo) for arquivo in ["quarto.csv", "reserva.csv", "produto.csv"]
+                  if arquivo in alterados}     # <-- arquivo -> linhas
+        carregadas = self.__carregadas
+        return linhas, carregadas, self.__dados_snapshot() if linhas and carregadas is None else None
+
+    def __grava_banco(self, sequencia, quartos, reservas, linhas, produtos):
+        """Método que grava no banco as linhas copiadas pelo salva_dados e guarda o id das reservas novas."""
+        novos = self.__banco.salva(quartos, linhas, produtos, sequencia)
+        with self.__trava:
+            self.__ids_banco.update(zip([reserva for reserva, linha in zip(reservas, linhas) if linha[0] is None], novos))
+
+    def __grava_csv(self, sequencia, linhas, carregadas, snapshot):
+        """Método que grava nos CSVs as linhas copiadas pelo salva_dados, com o ponto de controle, e
+        depois o snapshot."""
+        temporarios = {}    # <-- arquivo -> temporário já gravado no disco
+        for arquivo, conteudo in linhas.items():
+            if arquivo == "reserva.csv":
+                conteudo = [reserva for reserva in conteudo if reserva[3] not in ["C","O"]]
+                if carregadas is not None:
+                    fora = self.__reservas_fora_da_carga(carregadas)
+                    carregadas = set(range(len(fora), len(fora) + len(conteudo)))
+                    conteudo = fora + conteudo
+            temporarios[arquivo] = self.__escreve_csv(arquivo, conteudo)
+        if temporarios or sequencia != self.__sequencia:
+            self.__grava_arquivos(temporarios, sequencia)
+        self.__carregadas = carregadas
+        if snapshot is not None:
+            self.__grava_snapshot(snapshot)
+        elif temporarios and os.path.exists(self.__caminho(self.ARQUIVO_SNAPSHOT)):
+            os.remove(self.__caminho(self.ARQUIVO_SNAPSHOT))   # <-- o snapshot teria só as reservas carregadas
+
+    def __registra(self, *campos):
+        """Método que numera a operação no diário, se houver um diário aberto. Chamado com a trava 
+        compartilhada presa junto com a alteração; o registro vai para o arquivo no __grava_diario.
+        As operações de reserva não entram no diário quando o arquivo fixo está em uso, pois já 
+        foram gravadas nele."""
+        if self.__arquivo_fixo is not None and campos[0] in ["reserva", "altera", "cancela", "checkin", "checkout",
+                                                                  "checkin_lote", "checkout_lote"]:
+            return
+        if self.__diario is not None and not self.__reaplicando:
+            self.__diario.registra(*campos)
+
+    def __grava_diario(self):
+        """Método que escreve no arquivo do diário os registros numerados pelas operações (e o fsync 
+        do lote), fora da trava compartilhada, então as consultas não esperam pelo disco."""
+        diario = self.__diario
+        if diario is not None:
+            diario.grava()
+
+    def __quarto_do_diario(self, numero, campos):
+        """Método que retorna o Quarto de um registro do diário. Gera ValueError se o quarto não 
+        existir mais, como as linhas inválidas dos CSVs, em vez de reaplicar a operação sem quarto."""
+        quarto = self.encontra_quarto(numero)
+        if quarto is None:
+            raise ValueError(f"Quarto inexistente no diário: {campos}")
+        return quarto
+
+    def __reaplica(self, campos):
+        """Método que refaz uma operação lida do diário."""
+        match campos:
+            case ["reserva", cliente, dia_inicio, dia_fim, numero_quarto]:
+                data_inicio = le_data(dia_inicio)
+                data_fim = le_data(dia_fim)
+                self.realiza_reserva(cliente, data_inicio, data_fim, self.__quarto_do_diario(numero_quarto, campos))
+            case ["altera", chave, cliente, dia_inicio, dia_fim, numero_quarto]:
+                quarto = self.__quarto_do_diario(numero_quarto, campos)
+                for reserva in self.__reservas_das_chaves("A", [chave]) + self.__reservas_das_chaves("I", [chave]):
+                    self.altera_reserva(reserva, cliente, le_data(dia_inicio), le_data(dia_fim), quarto)
+            case ["cancela", cliente, *chaves]:
+                self.cancela_reserva(cliente, self.__versoes_das_chaves("A", cliente, chaves))
+            case ["checkin", cliente, *chaves]:
+                self.realiza_checkin(cliente, self.__versoes_das_chaves("A", cliente, chaves))
+            case ["checkout", cliente, *chaves]:
+                self.realiza_checkout(cliente, self.__versoes_das_chaves("I", cliente, chaves))
+            case ["checkin_lote", *chaves]:
+                self.realiza_checkin_lote(self.__reservas_das_chaves("A", chaves))
+            case ["checkout_lote", *chaves]:
+                self.realiza_checkout_lote(self.__reservas_das_chaves("I", chaves))
+            case ["consumo", numero_quarto, codigo, qtd]:
+                self.registra_consumo(self.__quarto_do_diario(numero_quarto, campos), codigo, int(qtd))
+            case ["limpa", numero_quarto]:
+                self.limpa_consumo(self.__quarto_do_diario(numero_quarto, campos))
+
+    def abre_diario(self, arquivo="diario.csv", lote=20):
+        """Método que reaplica as operações do diário sobre os dados carregados dos CSVs e passa 
+        a registrar nele cada alteração. Os registros com sequência até a dos dados carregados já 
+        estão nos arquivos (o salva_dados gravou, mas o diário não chegou a ser esvaziado) e são 
+        pulados. Retorna a quantidade de operações reaplicadas."""
+        self.__diario = Diario(self.__caminho(arquivo), lote, self.__sequencia)
+        self.__reaplicando = True
+        reaplicadas = 0
+        try:
+            for sequencia, campos in self.__diario.registros():
+                if sequencia is None or sequencia > self.__sequencia:
+                    self.__reaplica(campos)
+                    reaplicadas += 1
+        finally:
+            self.__reaplicando = False
+        return reaplicadas
+
+    def sincroniza_diario(self, limite=500):
+        """Método que grava no disco as operações pendentes do diário e compacta
+        quando o diário passa de limite operações. Sem diário, salva os CSVs."""
+        if self.__diario is None:
+            self.salva_dados()
+        elif len(self.__diario) >= limite:
+            self.compacta()
+        else:
+            self.__diario.sincroniza()
+
+    def compacta(self):
+        """Método que reescreve os CSVs com o estado atual e esvazia o diário. Os registros feitos 
+        enquanto os dados eram gravados, com sequência maior que a dos dados salvos, ficam no diário."""
+        self.salva_dados()
+        if self.__diario is not None:
+            self.__diario.trunca(self.__sequencia)
+
+class RedePousadas:
+    """Classe representando uma rede de pousadas, cada uma com sua própria pasta de arquivos
+    (pousada.csv, quarto.csv, reserva.csv...). As pousadas são carregadas em paralelo e as 
+    buscas na rede inteira são feitas em todas as pousadas ao mesmo tempo (threads). Cada pousada
+    registra as suas alterações no diário da sua pasta, que é compactado no fecha."""
+    def __init__(self, max_threads=None):
+        self.__pousadas = {}        # <-- id da pousada -> Pousada
+        self.__executor = ThreadPoolExecutor(max_workers=max_threads)
+
+    @property
+    def pousadas(self):
+        """Método getter - rede.pousadas (dicionário id -> Pousada)"""
+        return self.__pousadas
+
+    def carrega(self, diretorios, preguicoso=True):
+        """Método que carrega em paralelo as pousadas das pastas informadas e reaplica o diário de
+        cada uma. diretorios pode ser um dicionário id -> pasta ou uma lista de pastas (o id passa a
+        ser o nome da pasta)."""
+        if not isinstance(diretorios, dict):
+            diretorios = {os.path.basename(os.path.normpath(diretorio)): diretorio for diretorio in diretorios}
+
+        def carrega_pousada(diretorio):
+            pousada = Utilidade().deserializa_pousada(os.path.join(diretorio, "pousada.csv"))
+            pousada.carrega_dados(preguicoso=preguicoso)
+            pousada.abre_diario()       # <-- alterações feitas depois do último salvamento
+            return pousada
+
+        futuros = {id_pousada: self.__executor.submit(carrega_pousada, diretorio)
+                   for id_pousada, diretorio in diretorios.items()}
+        for id_pousada, futuro in futuros.items():
+            self.__pousadas[id_pousada] = futuro.result()
+
+    def pousada(self, id_pousada):
+        """Método que retorna a Pousada com o id informado, ou None se não existir na rede."""
+        return self.__pousadas.get(id_pousada)
+
+    def executa(self, id_pousada, metodo, *args, **kwargs):
+        """Método que encaminha a chamada de um método para a pousada com o id informado,
+        ex.: rede.executa("centro", "realiza_checkin", "Marina"). As alterações ficam no diário 
+        da pousada até o compacta ou o fecha."""
+        return getattr(self.__pousadas[id_pousada], metodo)(*args, **kwargs)
+
+    def consulta_quartos_livres(self, dt_inicio, dt_fim, categoria=None, diaria_min=None, diaria_max=None):
+        """Método que busca quartos livres no período em todas as pousadas ao mesmo tempo e retorna 
+        uma única lista de (id da pousada, Quarto) ordenada pelo valor da diária."""
+        futuros = {id_pousada: self.__executor.submit(pousada.consulta_quartos_livres, dt_inicio, dt_fim,
+                                                      categoria, diaria_min, diaria_max)
+                   for id_pousada, pousada in self.__pousadas.items()}
+        resultados = [[(id_pousada, quarto) for quarto in futuro.result()] for id_pousada, futuro in futuros.items()]
+        return list(heapq.merge(*resultados, key=lambda item: item[1].diaria))
+
+    def compacta(self):
+        """Método que salva os dados e esvazia o diário de todas as pousadas em paralelo."""
+        futuros = [self.__executor.submit(pousada.compacta) for pousada in self.__pousadas.values()]
+        for futuro in futuros:
+            futuro.result()
+
+    def fecha(self):
+        """Método que compacta todas as pousadas e encerra as threads da rede."""
+        try:
+            self.compacta()
+        finally:
+            self.__executor.shutdown()
+
+class ServidorPousada:
+    """Classe representando um servidor HTTP/JSON (asyncio, só biblioteca padrão) que atende
+    vários clientes ao mesmo tempo sobre uma única Pousada em memória. As consultas são 
+    respondidas direto, enquanto todas as alterações passam por uma fila atendida por uma
+    única tarefa escritora, uma de cada vez."""
+    MOTIVOS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 409: "Conflict",
+               500: "Internal Server Error"}
+
+    def __init__(self, pousada):
+        self.__pousada = pousada
+        self.__fila = None          # <-- (função, argumentos, futuro) das alterações pendentes
+        self.__escritor = None
+
+    async def executa(self, host="127.0.0.1", porta=8080):
+        """Método que inicia a tarefa escritora e atende conexões até ser cancelado."""
+        self.__fila = asyncio.Queue()
+        self.__escritor = asyncio.create_task(self.__escreve_fila())
+        try:
+            servidor = await asyncio.start_server(self.__atende, host, porta)
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            self.__escritor.cancel()
+
+    async def __escreve_fila(self):
+        """Tarefa escritora: executa as alterações da fila na ordem em que chegaram, uma de cada 
+        vez, numa thread separada, para a gravação do diário e dos arquivos (fsync) não parar o 
+        atendimento das outras conexões."""
+        while True:
+            funcao, args, futuro = await self.__fila.get()
+            try:
+                futuro.set_result(await asyncio.to_thread(funcao, *args))
+            except Exception as erro:
+                futuro.set_exception(erro)
+
+    async def __altera(self, funcao, *args):
+        """Método que coloca uma alteração na fila da tarefa escritora e espera o resultado."""
+        futuro = asyncio.get_running_loop().create_future()
+        await self.__fila.put((funcao, args, futuro))
+        return await futuro
+
+    def __quarto_json(self, quarto):
+        return {"numero": quarto.numero, "categoria": quarto.categoria, "diaria": quarto.diaria,
+                "versao": quarto.versao}
+
+    def __reserva_json(self, reserva):
+        return {"cliente": reserva.cliente, "inicio": escreve_data(reserva.dia_inicio),
+                "fim": escreve_data(reserva.dia_fim), "status": reserva.status, "versao": reserva.versao,
+                "quarto": self.__quarto_json(reserva.quarto), "folio": reserva.folio}
+
+    def __data(self, dados, campo, obrigatorio=True):
+        """Método que lê uma data dd-mm-YYYY dos dados da requisição, gera ValueError se for inválida."""
+        texto = dados.get(campo)
+        if not texto and not obrigatorio:
+            return None
+        data = le_data(texto) if isinstance(texto, str) else None
+        if data is None:
+            raise ValueError(f"Data inválida em '{campo}'")
+        return data
+
+    def __cliente(self, dados, obrigatorio=True):
+        """Método que lê o nome do cliente dos dados da requisição, gera ValueError se não for um texto."""
+        cliente = dados.get("cliente")
+        if not cliente and not obrigatorio:
+            return None
+        if not cliente or not isinstance(cliente, str):
+            raise ValueError("Não foi informado o nome do cliente")
+        return cliente
+
+    def __lista(self, dados, campo, tipos):
+        """Método que lê uma lista opcional dos dados da requisição, gera ValueError se ela não for
+        uma lista ou se algum item não for de um dos tipos informados."""
+        valores = dados.get(campo, [])
+        if not isinstance(valores, list) or not all(isinstance(valor, tipos) for valor in valores):
+            raise ValueError(f"Lista inválida em '{campo}'")
+        return valores
+
+    def __quarto(self, dados):
+        """Método que busca o quarto informado nos dados, gera ValueError se não existir."""
+        quarto = self.__pousada.encontra_quarto(dados.get("quarto", ""))
+        if quarto is None:
+            raise ValueError("Esse quarto não existe")
+        return quarto
+
+    def __reserva_nova(self, cliente, dt_inicio, dt_fim, quarto):
+        """Alteração executada pela escritora: faz a reserva com as mesmas verificações do menu."""
+        if self.__pousada.consulta_reserva(cliente):
+            return 409, {"erro": "Cliente já possui reserva ativa"}
+        if self.__pousada.reserva_se_disponivel(cliente, dt_inicio, dt_fim, quarto) is None:
+            return 409, {"erro": "Quarto esta indisponivel nessa data"}
+        return 201, [self.__reserva_json(reserva) for reserva in self.__pousada.consulta_reserva(cliente)]
+
+    def __reservas_lote(self, pedidos):
+        """Alteração executada pela escritora: faz o lote de reservas e monta o resultado de cada pedido."""
+        lote = [(pedido.get("cliente"), le_data(pedido.get("inicio") or ""), le_data(pedido.get("fim") or ""),
+                 self.__pousada.encontra_quarto(pedido.get("quarto") or 0)) for pedido in pedidos]
+        return 200, [{"reserva": self.__reserva_json(reserva)} if reserva else {"erro": motivo}
+                     for reserva, motivo in self.__pousada.realiza_reservas_lote(lote)]
+
+    def __checkout(self, cliente):
+        """Alteração executada pela escritora: faz o check-out, monta a conta e limpa o consumo."""
+        reservas = self.__pousada.consulta_checkin(cliente)
+        if not self.__pousada.realiza_checkout(cliente):
+            return 404, {"erro": f"Não existe check-in ativo no nome de {cliente}"}
+        contas = [self.__reserva_json(reserva) for reserva in reservas]
+        for reserva in reservas:
+            self.__pousada.limpa_consumo(reserva.quarto)
+        return 200, contas
+
+    def __muda_status_lote(self, metodo, dados):
+        """Alteração executada pela escritora: check-in ou check-out em grupo das reservas que atendem
+        os critérios (lista de clientes, data de início e lista de quartos). Ao menos um critério é 
+        obrigatório, senão gera ValueError."""
+        clientes = {cliente.casefold() for cliente in self.__lista(dados, "clientes", str)}
+        dt_inicio = self.__data(dados, "inicio", False)
+        quartos = {int(numero) for numero in self.__lista(dados, "quartos", (int, str))}
+        if not clientes and dt_inicio is None and not quartos:
+            raise ValueError("Informe os clientes, a data de início ou os quartos do grupo")
+        folios = metodo(filtro=lambda reserva: (not clientes or reserva.cliente.casefold() in clientes)
+                                               and (dt_inicio is None or reserva.dia_inicio == dt_inicio)
+                                               and (not quartos or reserva.quarto.numero in quartos))
+        if not folios:
+            return 404, {"erro": "Nenhuma reserva atende aos critérios"}
+        return 200, [{"quarto": numero, "reservas": [self.__reserva_json(reserva) for reserva in folio["reservas"]],
+                      "dias": folio["dias"], "diarias": folio["diarias"], "consumo": folio["consumo"],
+                      "total": folio["total"]} for numero, folio in folios.items()]
+
+    def __consumo(self, cliente, codigo, qtd, versao):
+        """Alteração executada pela escritora: registra o consumo no quarto do check-in do cliente."""
+        reservas = self.__pousada.consulta_checkin(cliente)
+        if not reservas:
+            return 404, {"erro": f"Não existe check-in ativo no nome de {cliente}"}
+        produto = self.__pousada.registra_consumo(reservas[0].quarto, codigo, qtd, versao)
+        if produto is None:
+            return 404, {"erro": "Produto não existe"}
+        return 200, self.__reserva_json(reservas[0])
+
+    def __muda_status(self, metodo, consulta, cliente):
+        """Alteração executada pela escritora: cancelamento ou check-in das reservas ativas do cliente."""
+        reservas = consulta(cliente)
+        if not metodo(cliente):
+            return 404, {"erro": f"Não existe reserva ativa no nome de {cliente}"}
+        return 200, [self.__reserva_json(reserva) for reserva in reservas]
+
+    async def __rota(self, metodo, caminho, dados):
+        """Método que executa a operação da rota pedida e retorna (status HTTP, corpo)."""
+        pousada = self.__pousada
+        match metodo, caminho:
+            case "GET", "/disponibilidade":
+                disponivel = pousada.consulta_disponibilidade(self.__data(dados, "inicio"), self.__data(dados, "fim"),
+                                                              self.__quarto(dados))
+                return 200, {"disponivel": disponivel}
+            case "GET", "/quartos-livres":
+                diaria_min, diaria_max = dados.get("diaria_min"), dados.get("diaria_max")
+                quartos = pousada.consulta_quartos_livres(self.__data(dados, "inicio"), self.__data(dados, "fim"),
+                                                          dados.get("categoria"),
+                                                          float(diaria_min) if diaria_min else None,
+                                                          float(diaria_max) if diaria_max else None)
+                return 200, [self.__quarto_json(quarto) for quarto in quartos]
+            case "GET", "/reservas":
+                consulta = pousada.consulta_checkin if dados.get("status") == "I" else pousada.consulta_reserva
+                reservas = consulta(self.__cliente(dados, False), self.__data(dados, "inicio", False),
+                                    self.__data(dados, "fim", False), dados.get("quarto"))
+                return 200, [self.__reserva_json(reserva) for reserva in reservas or []]
+            case "GET", "/folio":
+                reservas = pousada.consulta_checkin(self.__cliente(dados))
+                if not reservas:
+                    return 404, {"erro": "Não existe check-in ativo para esse cliente"}
+                return 200, [self.__reserva_json(reserva) for reserva in reservas]
+            case "POST", "/reservas":
+                dt_inicio, dt_fim = self.__data(dados, "inicio"), self.__data(dados, "fim")
+                if dt_fim < dt_inicio:
+                    raise ValueError("A data de fim é anterior à data de início")
+                return await self.__altera(self.__reserva_nova, self.__cliente(dados), dt_inicio, dt_fim,
+                                           self.__quarto(dados))
+            case "POST", "/reservas/lote":
+                if not isinstance(dados.get("pedidos"), list):
+                    raise ValueError("Não foi informada a lista de pedidos")
+                for pedido in dados["pedidos"]:
+                    if not isinstance(pedido, dict) or not all(isinstance(pedido.get(campo) or "", str)
+                                                               for campo in ["cliente", "inicio", "fim"]):
+                        raise ValueError("Pedido inválido no lote")
+                return await self.__altera(self.__reservas_lote, dados["pedidos"])
+            case "POST", "/cancelamentos":
+                return await self.__altera(self.__muda_status, pousada.cancela_reserva, pousada.consulta_reserva,
+                                           self.__cliente(dados))
+            case "POST", "/checkin":
+                return await self.__altera(self.__muda_status, pousada.realiza_checkin, pousada.consulta_reserva,
+                                           self.__cliente(dados))
+            case "POST", "/checkout":
+                return await self.__altera(self.__checkout, self.__cliente(dados))
+            case "POST", "/checkin/lote":
+                return await self.__altera(self.__muda_status_lote, pousada.realiza_checkin_lote, dados)
+            case "POST", "/checkout/lote":
+                return await self.__altera(self.__muda_status_lote, pousada.realiza_checkout_lote, dados)
+            case "POST", "/consumo":
+                return await self.__altera(self.__consumo, self.__cliente(dados), int(dados.get("codigo", 0)),
+                                           int(dados.get("qtd", 1)),
+                                           int(dados["versao"]) if "versao" in dados else None)
+        return 404, {"erro": "Rota não encontrada"}
+
+    async def __le_requisicao(self, linha, reader):
+        """Método que lê o resto de uma requisição a partir da primeira linha e retorna o método, a URL,
+        os cabeçalhos e o corpo (bytes). Gera ValueError se a linha ou o Content-Length estiverem 
+        mal formados, e aí não dá para saber onde começa a próxima requisição."""
+        metodo, alvo, _ = linha.decode().split(" ", 2)
+        cabecalhos = {}
+        while (cabecalho := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            nome, _, valor = cabecalho.decode().partition(":")
+            cabecalhos[nome.strip().lower()] = valor.strip()
+        tamanho = int(cabecalhos.get("content-length", 0))
+        if tamanho < 0:
+            raise ValueError("Content-Length inválido")
+        corpo = await reader.readexactly(tamanho) if tamanho else b""
+        return metodo, urlsplit(alvo), cabecalhos, corpo
+
+    def __dados(self, url, corpo):
+        """Método que junta os parâmetros da URL com o corpo JSON da requisição, gera ValueError 
+        se o corpo não for um objeto JSON."""
+        dados = {nome: valores[0] for nome, valores in parse_qs(url.query).items()}
+        if corpo:
+            objeto = json.loads(corpo)
+            if not isinstance(objeto, dict):
+                raise ValueError("O corpo da requisição deve ser um objeto JSON")
+            dados.update(objeto)
+        return dados
+
+    async def __atende(self, reader, writer):
+        """Método que atende uma conexão, respondendo as requisições enquanto ela ficar aberta.
+        Requisições mal formadas recebem 400 e erros inesperados recebem 500; quando a requisição 
+        não pôde ser lida até o fim, a conexão é fechada depois da resposta."""
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha.strip():
+                    break
+                cabecalhos = None
+                try:
+                    metodo, url, cabecalhos, corpo = await self.__le_requisicao(linha, reader)
+                    status, corpo = await self.__rota(metodo, url.path, self.__dados(url, corpo))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except ConflitoVersao as erro:
+                    status, corpo = 409, {"erro": str(erro)}
+                except (ValueError, TypeError) as erro:
+                    status, corpo = 400, {"erro": str(erro)}
+                except Exception:
+                    status, corpo = 500, {"erro": "Erro interno do servidor"}
+                resposta = json.dumps(corpo, ensure_ascii=False).encode()
+                writer.write(f"HTTP/1.1 {status} {self.MOTIVOS[status]}\r\n"
+                             "Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(resposta)}\r\n\r\n".encode() + resposta)
+                await writer.drain()
+                if cabecalhos is None or cabecalhos.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
 
 class Utilidade:
     """Classe representando uma Pousada"""
@@ -403,21 +2227,22 @@ class Utilidade:
             dados = list(reader)
         pousada_nome = dados[0][0]
         pousada_contato = dados[0][1]
-        return Pousada(pousada_nome,pousada_contato)
+        return Pousada(pousada_nome,pousada_contato,os.path.dirname(arquivo))
+
+    def le_data(self, str_data):
+        """Valida e converte a data no formato dd-mm-YYYY numa única chamada, retorna None se for inválida"""
+        return le_data(str_data)
 
     def data_eh_valida(self, str_data):
         """Valida se a data esta no formato correto dd-mm-YY"""
-        try:
-            datetime.strptime(str_data, "%d-%m-%Y")
-            return True
-        except ValueError:
-            return False
+        return le_data(str_data) is not None
 
 def main():
     """Main"""
     ut = Utilidade()
     pousada = ut.deserializa_pousada("pousada.csv")
-    pousada.carrega_dados()
+    pousada.carrega_dados(preguicoso=True)
+    pousada.abre_diario("diario.csv")
 
     while True:
         ut.limpar_tela()
@@ -432,9 +2257,9 @@ def main():
             while True:
                 str_dt_inicio = input("Data inicial da reserva (DD-MM-AAAA): ")
                 str_dt_fim = input("Data final da reserva (DD-MM-YYYY): ")
-                if ut.data_eh_valida(str_dt_inicio) and ut.data_eh_valida(str_dt_fim):
-                    dt_inicio = datetime.strptime(str_dt_inicio, "%d-%m-%Y").date()
-                    dt_fim = datetime.strptime(str_dt_fim, "%d-%m-%Y").date()
+                dt_inicio = ut.le_data(str_dt_inicio)
+                dt_fim = ut.le_data(str_dt_fim)
+                if dt_inicio and dt_fim:
                     break
                 else:
                     print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi possivel verificar a data, certifique-se que é uma data valida no formato correto (DD-MM-AAAA)\n")
@@ -471,8 +2296,8 @@ def main():
                 cliente = input("Nome do cliente: ")
                 while True:
                     str_dt_inicio = input("Data inicial reserva (DD-MM-YYYY): ")
-                    if ut.data_eh_valida(str_dt_inicio):
-                        dt_inicio = datetime.strptime(str_dt_inicio, "%d-%m-%Y").date()
+                    dt_inicio = ut.le_data(str_dt_inicio)
+                    if dt_inicio:
                         break
                     elif not str_dt_inicio:
                         dt_inicio = None
@@ -481,8 +2306,8 @@ def main():
                         print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi possivel verificar a data, certifique-se que é uma data valida no formato correto (DD-MM-AAAA)\n")
                 while True:
                     str_dt_fim = input("Data final reserva (DD-MM-YYYY): ")
-                    if ut.data_eh_valida(str_dt_fim):
-                        dt_fim = datetime.strptime(str_dt_fim, "%d-%m-%Y").date()
+                    dt_fim = ut.le_data(str_dt_fim)
+                    if dt_fim:
                         break
                     elif not str_dt_fim:
                         dt_fim = None
@@ -534,9 +2359,9 @@ def main():
             while True:
                 str_dt_inicio = input("Data inicial da reserva: ")
                 str_dt_fim = input("Data final da reserva: ")
-                if ut.data_eh_valida(str_dt_inicio) and ut.data_eh_valida(str_dt_fim):
-                    dt_inicio = datetime.strptime(str_dt_inicio, "%d-%m-%Y").date()
-                    dt_fim = datetime.strptime(str_dt_inicio, "%d-%m-%Y").date()
+                dt_inicio = ut.le_data(str_dt_inicio)
+                dt_fim = ut.le_data(str_dt_fim)
+                if dt_inicio and dt_fim:
                     break
                 else:
                     print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi possivel verificar a data, certifique-se que é uma data valida no formato correto (DD-MM-AAAA)\n")
@@ -553,11 +2378,10 @@ def main():
             if pousada.consulta_reserva(cliente, None, None, None):
                 ut.imprime_com_retincencias("\nCliente já possui reserva ativa")
                 input("\nPressione Enter para voltar ao menu...")
-            elif not pousada.consulta_disponibilidade(dt_inicio, dt_fim, quarto):
+            elif pousada.reserva_se_disponivel(cliente, dt_inicio, dt_fim, quarto) is None:
                 ut.imprime_com_retincencias("\nQuarto esta indisponivel nessa data")
                 input("\nPressione Enter para voltar ao menu...")
             else:
-                pousada.realiza_reserva(cliente, dt_inicio, dt_fim, quarto)
                 print("\n\033[32m" + "Reserva realizada com sucesso" + "\033[0m")
                 input("\nPressione Enter para voltar ao menu...")
 
@@ -569,12 +2393,18 @@ def main():
                 if not cliente:
                     print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi digitado o nome do cliente\n")
                 else:
+                    reservas = pousada.consulta_reserva(cliente)
+                    versoes = {reserva: reserva.versao for reserva in reservas or []}   # <-- versões que o atendente viu
                     break
-            if pousada.cancela_reserva(cliente):
-                print("\n\033[32m" + "Reserva Cancelada com sucesso" + "\033[0m")
-                input("\nPressione Enter para voltar ao menu...")
-            else:
-                ut.imprime_com_retincencias(f"\nNão existe reserva ativa no nome de {cliente}")
+            try:
+                if pousada.cancela_reserva(cliente, versoes):
+                    print("\n\033[32m" + "Reserva Cancelada com sucesso" + "\033[0m")
+                    input("\nPressione Enter para voltar ao menu...")
+                else:
+                    ut.imprime_com_retincencias(f"\nNão existe reserva ativa no nome de {cliente}")
+                    input("\nPressione Enter para voltar ao menu...")
+            except ConflitoVersao as erro:
+                ut.imprime_com_retincencias(f"\n{erro}, tente novamente")
                 input("\nPressione Enter para voltar ao menu...")
 
         elif escolha == "5":
@@ -586,16 +2416,23 @@ def main():
                     print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi digitado o nome do cliente\n")
                 else:
                     reservas = pousada.consulta_reserva(cliente)
+                    versoes = {reserva: reserva.versao for reserva in reservas or []}
                     if reservas is not None:   
                         reserva = reservas[0]
                         break
                     else: 
                         break
-            if pousada.realiza_checkin(cliente):     
+            try:
+                fez_checkin = pousada.realiza_checkin(cliente, versoes)
+            except ConflitoVersao as erro:
+                ut.imprime_com_retincencias(f"\n{erro}, tente novamente")
+                input("\nPressione Enter para voltar ao menu...")
+                continue
+            if fez_checkin:     
                 print("\n\033[32m" + "Check-in realizado com sucesso" + "\033[0m")
                 print(f"Periodo: {reserva.dia_inicio} até {reserva.dia_fim}")
-                print(f"Quantidade de dias: {pousada.calcula_dias(reserva.dia_inicio, reserva.dia_fim)}")
-                print(f"Valor total (diárias): R${pousada.calcula_dias(reserva.dia_inicio, reserva.dia_fim)*reserva.quarto.diaria:.2f}")
+                print(f"Quantidade de dias: {reserva.dias}")
+                print(f"Valor total (diárias): R${reserva.valor_diarias:.2f}")
                 print("Quarto:")
                 print(f"    Numero: {reserva.quarto.numero}")
                 print(f"    Categoria: {reserva.quarto.categoria}")
@@ -614,20 +2451,28 @@ def main():
                     print("\n\033[31m" + "ERRO: " + "\033[0m" + "Não foi digitado o nome do cliente\n")
                 else:
                     reservas = pousada.consulta_checkin(cliente)
+                    versoes = {reserva: reserva.versao for reserva in reservas or []}
                     if reservas is not None:
                         reserva = reservas[0]
                         break
                     else: 
                         break
-            if pousada.realiza_checkout(cliente):     
+            try:
+                fez_checkout = pousada.realiza_checkout(cliente, versoes)
+            except ConflitoVersao as erro:
+                ut.imprime_com_retincencias(f"\n{erro}, tente novamente")
+                input("\nPressione Enter para voltar ao menu...")
+                continue
+            if fez_checkout:     
                 print("\n\033[32m" + "Check-out realizado com sucesso" + "\033[0m")
                 print(f"Periodo: {reserva.dia_inicio} até {reserva.dia_fim}")
-                print(f"Quantidade de dias: {pousada.calcula_dias(reserva.dia_inicio, reserva.dia_fim)}")
-                print(f"Valor diárias: R${pousada.calcula_dias(reserva.dia_inicio, reserva.dia_fim)*reserva.quarto.diaria:.2f}")
-                print(f"Valor consumo (copa): R${reserva.quarto.valor_total_consumo(pousada):.2f}")
+                folio = reserva.folio
+                print(f"Quantidade de dias: {folio['dias']}")
+                print(f"Valor diárias: R${folio['diarias']:.2f}")
+                print(f"Valor consumo (copa): R${folio['consumo']:.2f}")
                 reserva.quarto.lista_consumo(pousada)
-                print(f"Valor Total: R${reserva.quarto.valor_total_consumo(pousada)+(pousada.calcula_dias(reserva.dia_inicio, reserva.dia_fim)*reserva.quarto.diaria):.2f}")
-                reserva.quarto.limpa_consumo()
+                print(f"Valor Total: R${folio['total']:.2f}")
+                pousada.limpa_consumo(reserva.quarto)
                 input("\nPressione Enter para voltar ao menu...")
                 
             else:
@@ -650,6 +2495,7 @@ def main():
                     else: 
                         break
             if pousada.consulta_checkin(cliente):   
+                versao = reserva.quarto.versao      # <-- versão do consumo quando a lista foi mostrada
                 pousada.lista_produto()
                 cod_produto = input("\nInforme o código do produto ou pressione Enter para sair: ")
                 qtd = int(input("Informe a quantidade: "))
@@ -659,9 +2505,14 @@ def main():
                             cod_produto = input("\nInforme um código válido: ")
                             qtd = int(input("Informe a quantidade: "))
                         else:
-                            reserva.quarto.adiciona_consumo(cod_produto, qtd)
-                            produto = pousada.encontra_produto(int(cod_produto))
-                            print(f"{produto.nome} x{qtd} adicionado(a) ")
+                            try:
+                                produto = pousada.registra_consumo(reserva.quarto, cod_produto, qtd, versao)
+                                print(f"{produto.nome} x{qtd} adicionado(a) ")
+                            except ConflitoVersao as erro:
+                                print(f"\n{erro}, informe o produto novamente")
+                            except ValueError as erro:
+                                print(f"\n{erro}")
+                            versao = reserva.quarto.versao
                             break
                     cod_produto = input("\nInforme o código de outro produto ou pressione Enter para sair: ")
                     if cod_produto is not "":
@@ -673,12 +2524,26 @@ def main():
                 input("\nPressione Enter para voltar ao menu...")
 
         elif escolha == "8":
-            pousada.salva_dados()
+            pousada.sincroniza_diario()
             ut.imprime_com_retincencias("\nSalvando dados")
-            pousada.carrega_dados()
         elif escolha == "0":
+            pousada.compacta()
             ut.imprime_com_retincencias("\nSaindo")
             break
 
+def main_api(porta=8080):
+    """Carrega a pousada como o main e a serve pela API HTTP/JSON em vez do menu."""
+    ut = Utilidade()
+    pousada = ut.deserializa_pousada("pousada.csv")
+    pousada.carrega_dados(preguicoso=True)
+    pousada.abre_diario("diario.csv")
+    try:
+        asyncio.run(ServidorPousada(pousada).executa(porta=porta))
+    finally:
+        pousada.compacta()
+
 if __name__ == '__main__':
-    main()
+    if "--api" in sys.argv:
+        main_api()
+    else:
+        main()
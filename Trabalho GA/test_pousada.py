@@ -0,0 +1,705 @@
+"""Testes da Pousada (TrabalhoGA v4.py), rodados com: python -m unittest test_pousada"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import sys
+import threading
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from datetime import date, timedelta
+
+CAMINHO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TrabalhoGA v4.py")
+especificacao = importlib.util.spec_from_file_location("trabalho_ga_v4", CAMINHO)
+ga = importlib.util.module_from_spec(especificacao)
+especificacao.loader.exec_module(ga)
+
+QUARTOS = ["1,S,500.0", "2,S,500.0", "3,M,800.0", "4,M,800.0", "5,P,1000.0", "6,P,1000.0"]
+PRODUTOS = ["1,cafe,35.5", "2,massa,2.0"]
+
+class PousadaTeste(unittest.TestCase):
+    """Base dos testes: cada teste usa uma pasta temporária com os CSVs da pousada."""
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta)
+        self.escreve("quarto.csv", QUARTOS)
+        self.escreve("produto.csv", PRODUTOS)
+        self.escreve("reserva.csv", [])
+
+    def escreve(self, arquivo, linhas):
+        """Grava as linhas no arquivo da pasta do teste."""
+        with open(os.path.join(self.pasta, arquivo), "w") as f:
+            f.writelines(linha + "\n" for linha in linhas)
+
+    def le(self, arquivo):
+        """Retorna as linhas do arquivo da pasta do teste."""
+        with open(os.path.join(self.pasta, arquivo)) as f:
+            return f.read().splitlines()
+
+    def pousada(self, **opcoes):
+        """Retorna uma Pousada com os dados da pasta do teste já carregados."""
+        pousada = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        pousada.carrega_dados(**opcoes)
+        return pousada
+
+class AgendaTeste(PousadaTeste):
+    def test_reserva_que_envolve_o_periodo(self):
+        quarto = ga.Quarto(1, "S", 500.0)
+        ana = ga.Reserva("Ana", date(2024, 1, 1), date(2024, 1, 20), "A", quarto)
+        agenda = ga.AgendaQuarto()
+        agenda.adiciona(ana)
+        agenda.adiciona(ga.Reserva("Bia", date(2024, 1, 5), date(2024, 1, 6), "A", quarto))
+        self.assertFalse(agenda.esta_livre(date(2024, 1, 10).toordinal(), date(2024, 1, 12).toordinal()))
+        agenda.remove(ana)
+        self.assertTrue(agenda.esta_livre(date(2024, 1, 10).toordinal(), date(2024, 1, 12).toordinal()))
+        self.assertFalse(agenda.esta_livre(date(2024, 1, 6).toordinal(), date(2024, 1, 8).toordinal()))
+
+    def test_reservas_sobrepostas_no_csv(self):
+        self.escreve("reserva.csv", ["Ana,01-01-2024,20-01-2024,A,1", "Bia,05-01-2024,06-01-2024,A,1"])
+        pousada = self.pousada()
+        quarto = pousada.encontra_quarto(1)
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 1, 10), date(2024, 1, 12), quarto))
+        self.assertTrue(pousada.consulta_disponibilidade(date(2024, 1, 21), date(2024, 1, 22), quarto))
+
+class AlteraReservaTeste(PousadaTeste):
+    def test_altera_datas_mantem_indices(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        pousada.abre_diario()
+        ana, = pousada.consulta_reserva("Ana")
+        quarto = pousada.encontra_quarto(1)
+        self.assertTrue(pousada.altera_reserva(ana, dt_inicio=date(2024, 3, 10), dt_fim=date(2024, 3, 12)))
+        self.assertEqual(pousada.consulta_reserva(None, date(2024, 3, 10)), [ana])
+        self.assertIsNone(pousada.consulta_reserva(None, date(2024, 3, 1)))
+        self.assertTrue(pousada.consulta_disponibilidade(date(2024, 3, 1), date(2024, 3, 5), quarto))
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 3, 11), date(2024, 3, 11), quarto))
+        self.assertEqual(ana.dias, 3)
+
+        reaberta = self.pousada()
+        reaberta.abre_diario()
+        self.assertEqual([reserva.dia_inicio for reserva in reaberta.consulta_reserva("Ana")], [date(2024, 3, 10)])
+
+    def test_reserva_sem_setters(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        ana, = pousada.consulta_reserva("Ana")
+        for campo, valor in [("status", "C"), ("cliente", "Bia"), ("quarto", pousada.encontra_quarto(2))]:
+            with self.assertRaises(AttributeError):
+                setattr(ana, campo, valor)
+        self.assertEqual(pousada.consulta_reserva("Ana"), [ana])
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 3, 2), date(2024, 3, 2), ana.quarto))
+
+    def test_altera_para_periodo_ocupado(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Bia,10-03-2024,12-03-2024,A,2"])
+        pousada = self.pousada()
+        ana, = pousada.consulta_reserva("Ana")
+        self.assertIsNone(pousada.altera_reserva(ana, dt_inicio=date(2024, 3, 11), dt_fim=date(2024, 3, 11),
+                                                 quarto=pousada.encontra_quarto(2)))
+        self.assertEqual(pousada.consulta_reserva(None, None, None, 1), [ana])
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 3, 2), date(2024, 3, 2), ana.quarto))
+
+    def test_versao_so_muda_com_remarcacao_e_status(self):
+        pousada = self.pousada()
+        ana = pousada.realiza_reserva("Ana", date(2024, 3, 1), date(2024, 3, 5), pousada.encontra_quarto(1))
+        self.assertEqual(ana.versao, 0)
+        pousada.altera_reserva(ana, dt_fim=date(2024, 3, 6))
+        self.assertEqual(ana.versao, 1)
+        pousada.realiza_checkin("Ana")
+        self.assertEqual(ana.versao, 2)
+
+    def test_altera_com_versao_antiga(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        ana, = pousada.consulta_reserva("Ana")
+        lida = ana.versao
+        self.assertTrue(pousada.altera_reserva(ana, dt_fim=date(2024, 3, 6), versao=lida))
+        with self.assertRaises(ga.ConflitoVersao):
+            pousada.altera_reserva(ana, dt_inicio=date(2024, 3, 10), dt_fim=date(2024, 3, 12), versao=lida)
+        self.assertEqual((ana.dia_inicio, ana.dia_fim), (date(2024, 3, 1), date(2024, 3, 6)))
+        self.assertEqual(pousada.consulta_reserva(None, date(2024, 3, 1)), [ana])
+
+class ConflitoStatusTeste(PousadaTeste):
+    def test_cancela_com_versao_antiga(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        ana, = pousada.consulta_reserva("Ana")
+        versoes = {ana: ana.versao}
+        pousada.altera_reserva(ana, dt_fim=date(2024, 3, 6))
+        with self.assertRaises(ga.ConflitoVersao):
+            pousada.cancela_reserva("Ana", versoes)
+        self.assertEqual(ana.status, "A")
+        self.assertEqual(pousada.consulta_reserva("Ana"), [ana])
+
+    def test_lote_nao_troca_nenhuma_se_uma_mudou(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Bia,01-03-2024,05-03-2024,A,2"])
+        pousada = self.pousada()
+        ana, = pousada.consulta_reserva("Ana")
+        bia, = pousada.consulta_reserva("Bia")
+        versoes = {ana: ana.versao, bia: bia.versao}
+        pousada.cancela_reserva("Bia")
+        with self.assertRaises(ga.ConflitoVersao):
+            pousada.realiza_checkin("Ana", versoes)
+        self.assertEqual(ana.status, "A")
+        self.assertEqual(pousada.hospedagens, [])
+
+class ConsumoTeste(PousadaTeste):
+    def test_consumo_com_versao_antiga(self):
+        pousada = self.pousada()
+        quarto = pousada.encontra_quarto(1)
+        lida = quarto.versao
+        pousada.registra_consumo(quarto, 1, 2, lida)
+        with self.assertRaises(ga.ConflitoVersao):
+            pousada.registra_consumo(quarto, 2, 1, lida)
+        with self.assertRaises(ga.ConflitoVersao):
+            quarto.adiciona_consumo(2, 1, 2.0, lida)
+        self.assertEqual(quarto.consumo, {1: 2})
+        self.assertEqual(quarto.valor_total_consumo(), 71.0)
+
+    def test_quantidade_nao_positiva(self):
+        pousada = self.pousada()
+        quarto = pousada.encontra_quarto(1)
+        pousada.registra_consumo(quarto, 1, 2)
+        for qtd in [0, -5]:
+            with self.assertRaises(ValueError):
+                pousada.registra_consumo(quarto, 1, qtd)
+        self.assertEqual(quarto.consumo, {1: 2})
+        self.assertEqual(quarto.valor_total_consumo(), 71.0)
+
+    def test_produto_inexistente_no_consumo(self):
+        self.escreve("quarto.csv", ["1,S,500.0,1:2,9:3"] + QUARTOS[1:])
+        with self.assertRaises(ValueError):
+            self.pousada()
+        self.assertEqual(self.le("quarto.csv")[0], "1,S,500.0,1:2,9:3")
+
+@unittest.skipUnless(ga.np is not None, "numpy não instalado")
+class CalendarioTeste(PousadaTeste):
+    def test_calendario_acompanha_a_agenda(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Bia,03-03-2024,04-03-2024,C,2"])
+        pousada = self.pousada()
+        self.assertTrue(pousada.ativa_calendario())
+        quarto1, quarto2 = pousada.encontra_quarto(1), pousada.encontra_quarto(2)
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 3, 5), date(2024, 3, 8), quarto1))
+        self.assertTrue(pousada.consulta_disponibilidade(date(2024, 3, 3), date(2024, 3, 3), quarto2))
+        longe = date(2026, 6, 1)   # <-- fora da matriz inicial, que precisa crescer
+        pousada.realiza_reserva("Cida", longe, longe + timedelta(2), quarto2)
+        self.assertFalse(pousada.consulta_disponibilidade(longe, longe, quarto2))
+        livres = [quarto.numero for quarto in pousada.consulta_quartos_livres(date(2024, 3, 2), date(2024, 3, 2))]
+        self.assertEqual(livres, [2, 3, 4, 5, 6])
+        pousada.cancela_reserva("Ana")
+        self.assertTrue(pousada.consulta_disponibilidade(date(2024, 3, 1), date(2024, 3, 5), quarto1))
+        novo = ga.Quarto(7, "S", 500.0)
+        pousada.adiciona_quarto(novo)
+        pousada.realiza_reserva("Duda", date(2024, 3, 1), date(2024, 3, 1), novo)
+        self.assertFalse(pousada.consulta_disponibilidade(date(2024, 3, 1), date(2024, 3, 1), novo))
+
+class SnapshotTeste(PousadaTeste):
+    def setUp(self):
+        super().setUp()
+        self.escreve("reserva.csv", ["Ana,01-03-2030,05-03-2030,A,1"])
+        pousada = self.pousada()
+        pousada.realiza_reserva("Bia", date(2030, 3, 1), date(2030, 3, 2), pousada.encontra_quarto(2))
+        pousada.salva_dados()      # <-- grava os CSVs e o snapshot
+
+    def test_carrega_do_snapshot(self):
+        with mock.patch.object(ga.Pousada, "le_objetos", side_effect=AssertionError("leu os CSVs")):
+            pousada = self.pousada()
+        self.assertEqual(sorted(reserva.cliente for reserva in pousada.reservas), ["Ana", "Bia"])
+
+    def test_csv_mais_novo_que_o_snapshot(self):
+        self.escreve("reserva.csv", ["Cida,01-03-2030,05-03-2030,A,3"])
+        instante = os.path.getmtime(os.path.join(self.pasta, ga.Pousada.ARQUIVO_SNAPSHOT)) + 10
+        os.utime(os.path.join(self.pasta, "reserva.csv"), (instante, instante))
+        self.assertEqual([reserva.cliente for reserva in self.pousada().reservas], ["Cida"])
+
+    def test_snapshot_de_outra_versao(self):
+        self.escreve("reserva.csv", ["Cida,01-03-2030,05-03-2030,A,3"])
+        snapshot = os.path.join(self.pasta, ga.Pousada.ARQUIVO_SNAPSHOT)
+        instante = os.path.getmtime(os.path.join(self.pasta, "reserva.csv")) + 10
+        os.utime(snapshot, (instante, instante))      # <-- o snapshot continua mais novo que os CSVs
+        self.assertEqual(sorted(reserva.cliente for reserva in self.pousada().reservas), ["Ana", "Bia"])
+        with mock.patch.object(ga.Pousada, "VERSAO_SNAPSHOT", ga.Pousada.VERSAO_SNAPSHOT + 1):
+            pousada = self.pousada()
+        self.assertEqual([reserva.cliente for reserva in pousada.reservas], ["Cida"])
+
+class CargaParcialTeste(PousadaTeste):
+    RESERVAS = ["Ana,01-03-2024,05-03-2024,A,1", "Bia,01-03-2024,05-03-2024,A,2", "Cris,01-03-2024,05-03-2024,I,3"]
+
+    def test_filtro_mantem_reservas_de_fora(self):
+        self.escreve("reserva.csv", self.RESERVAS)
+        pousada = self.pousada(filtro=lambda reserva: reserva.quarto.numero == 1)
+        pousada.cancela_reserva("Ana")
+        pousada.realiza_reserva("Duda", date(2024, 4, 1), date(2024, 4, 2), pousada.encontra_quarto(4))
+        pousada.salva_dados()
+        self.assertEqual(self.le("reserva.csv"), self.RESERVAS[1:] + ["Duda,01-04-2024,02-04-2024,A,4"])
+        pousada.realiza_checkin("Duda")
+        pousada.salva_dados()
+        self.assertEqual(self.le("reserva.csv"), self.RESERVAS[1:] + ["Duda,01-04-2024,02-04-2024,I,4"])
+        self.assertEqual(len(self.pousada().reservas), 3)
+
+    def test_faixa_mantem_reservas_de_fora(self):
+        self.escreve("reserva.csv", self.RESERVAS)
+        pousada = self.pousada()
+        pousada.adiciona_produto(ga.Produto(3, "suco", 8.0))
+        pousada.salva_dados()      # <-- grava o snapshot, que passa a ser a fonte da próxima carga
+        pousada = self.pousada(inicio=1, fim=2)
+        pousada.realiza_checkin("Bia")
+        pousada.salva_dados()
+        self.assertEqual(sorted(self.le("reserva.csv")),
+                         sorted([self.RESERVAS[0], "Bia,01-03-2024,05-03-2024,I,2", self.RESERVAS[2]]))
+        self.assertEqual(len(self.pousada().reservas), 3)
+
+    def test_carga_parcial_mantem_quartos_ocupados(self):
+        self.escreve("reserva.csv", self.RESERVAS)
+        for opcoes in [{"filtro": lambda reserva: reserva.quarto.numero == 1}, {"inicio": 0, "fim": 1}]:
+            pousada = self.pousada(**opcoes)
+            self.assertIsNone(pousada.reserva_se_disponivel("Duda", date(2024, 3, 2), date(2024, 3, 3), pousada.encontra_quarto(2)))
+            self.assertEqual([quarto.numero for quarto in pousada.consulta_quartos_livres(date(2024, 3, 2), date(2024, 3, 3))], [4, 5, 6])
+
+    def test_carga_parcial_do_arquivo_fixo(self):
+        self.escreve("reserva.csv", ["Eva,01-01-2024,02-01-2024,C,3"] + self.RESERVAS)
+        pousada = self.pousada()
+        pousada.usa_arquivo_fixo()
+        pousada.carrega_dados(inicio=0, fim=1)
+        self.assertEqual(sorted(reserva.cliente for reserva in pousada.reservas), ["Ana", "Bia", "Cris", "Eva"])
+        pousada.carrega_dados(inicio=1, fim=2)
+        self.assertEqual(sorted(reserva.cliente for reserva in pousada.reservas), ["Ana", "Bia", "Cris"])
+        self.assertIsNone(pousada.reserva_se_disponivel("Duda", date(2024, 3, 2), date(2024, 3, 3), pousada.encontra_quarto(3)))
+
+class DiarioTeste(PousadaTeste):
+    def opera(self, pousada):
+        """Faz uma reserva e registra consumo com o diário aberto e salva sem esvaziar o diário,
+        como numa queda entre o salva_dados e o trunca do compacta."""
+        pousada.abre_diario()
+        pousada.realiza_reserva("Duda", date(2024, 4, 1), date(2024, 4, 2), pousada.encontra_quarto(4))
+        pousada.registra_consumo(pousada.encontra_quarto(4), 1, 2)
+        pousada.salva_dados()
+
+    def confere(self, pousada):
+        self.assertEqual(pousada.abre_diario(), 0)
+        self.assertEqual(len(pousada.consulta_reserva("Duda")), 1)
+        self.assertEqual(pousada.encontra_quarto(4).consumo, {1: 2})
+
+    def test_queda_antes_de_truncar_csv(self):
+        self.opera(self.pousada())
+        self.confere(self.pousada())
+
+    def test_queda_antes_de_truncar_banco(self):
+        pousada = self.pousada()
+        pousada.usa_banco()
+        self.opera(pousada)
+        reaberta = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        reaberta.usa_banco()
+        reaberta.carrega_dados()
+        self.confere(reaberta)
+
+    def test_queda_no_meio_das_trocas(self):
+        trocas = []
+        substitui = os.replace
+        def cai_depois_do_ponto(origem, destino):
+            if trocas:
+                raise OSError("queda")
+            trocas.append(destino)
+            substitui(origem, destino)
+        with mock.patch.object(ga.os, "replace", cai_depois_do_ponto):
+            with self.assertRaises(OSError):
+                self.opera(self.pousada())
+        self.assertTrue(trocas[0].endswith("pousada.ponto"))
+        self.assertEqual(self.le("reserva.csv"), [])
+        self.confere(self.pousada())
+        self.assertEqual(self.le("reserva.csv"), ["Duda,01-04-2024,02-04-2024,A,4"])
+
+    def test_registros_continuam_depois_de_compactar(self):
+        pousada = self.pousada()
+        pousada.abre_diario()
+        pousada.registra_consumo(pousada.encontra_quarto(1), 1, 1)
+        pousada.compacta()
+        pousada.registra_consumo(pousada.encontra_quarto(1), 2, 3)
+        pousada.salva_dados()
+        reaberta = self.pousada()
+        self.assertEqual(reaberta.abre_diario(), 0)
+        self.assertEqual(reaberta.encontra_quarto(1).consumo, {1: 1, 2: 3})
+
+    def test_quarto_inexistente_no_diario(self):
+        for registro in ["1,reserva,Duda,01-04-2024,02-04-2024,9", "1,consumo,9,1,2", "1,limpa,9"]:
+            self.escreve("diario.csv", [registro])
+            with self.assertRaisesRegex(ValueError, "Quarto inexistente"):
+                self.pousada().abre_diario()
+
+class HistoricoTeste(PousadaTeste):
+    RESERVAS = ["Ana,01-01-2020,05-01-2020,A,1", "Bia,01-01-2020,02-01-2020,O,2"]
+
+    def confere_sem_repetidas(self, pousada):
+        pousada.cancela_reserva("Ana")
+        pousada.salva_dados()
+        self.assertEqual([reserva.cliente for reserva in pousada.reservas_por_status("C")], ["Ana"])
+        self.assertEqual([reserva.cliente for reserva in pousada.reservas_por_status("O")], ["Bia"])
+        self.assertEqual(len(pousada.reservas), 2)
+
+    def test_historico_do_arquivo_fixo(self):
+        self.escreve("reserva.csv", self.RESERVAS)
+        self.pousada().usa_arquivo_fixo()
+        pousada = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        pousada.usa_arquivo_fixo()
+        pousada.carrega_dados(preguicoso=True)
+        self.confere_sem_repetidas(pousada)
+
+    def test_historico_do_banco(self):
+        self.escreve("reserva.csv", self.RESERVAS)
+        self.pousada().usa_banco()
+        pousada = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        pousada.usa_banco()
+        pousada.carrega_dados(preguicoso=True)
+        self.confere_sem_repetidas(pousada)
+
+    def test_historico_depois_de_salvar_csv(self):
+        self.escreve("reserva.csv", self.RESERVAS + ["Cris,01-01-2020,02-01-2020,C,3"])
+        pousada = self.pousada(preguicoso=True)
+        pousada.registra_consumo(pousada.encontra_quarto(1), 1, 1)
+        pousada.salva_dados()      # <-- grava o snapshot, sem as reservas canceladas e encerradas
+        self.assertEqual(sorted(reserva.cliente for reserva in pousada.reservas), ["Ana", "Bia", "Cris"])
+
+class BancoTeste(PousadaTeste):
+    def reabre(self):
+        pousada = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        pousada.usa_banco()
+        return pousada
+
+    def test_reserva_de_novo_depois_de_cancelar(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Ana,01-03-2024,02-03-2024,A,2"])
+        pousada = self.pousada()
+        pousada.usa_banco()
+        primeira, segunda = pousada.consulta_reserva("Ana")
+        pousada.cancela_reserva("Ana", {primeira: primeira.versao})
+        pousada.realiza_reserva("Ana", date(2024, 3, 1), date(2024, 3, 3), pousada.encontra_quarto(1))
+        pousada.salva_dados()
+        pousada.cancela_reserva("Ana", {segunda: segunda.versao})
+        pousada.altera_reserva(pousada.consulta_reserva("Ana")[0], quarto=pousada.encontra_quarto(2))
+        pousada.salva_dados()
+        reaberta = self.reabre()
+        self.assertEqual([(reserva.quarto.numero, reserva.dia_fim) for reserva in reaberta.consulta_reserva("Ana")],
+                         [(2, date(2024, 3, 3))])
+        self.assertEqual(sorted((reserva.quarto.numero, reserva.dia_fim) for reserva in reaberta.reservas_por_status("C")),
+                         [(1, date(2024, 3, 5)), (2, date(2024, 3, 2))])
+
+    def test_banco_existente_substitui_os_csvs(self):
+        pousada = self.pousada()
+        pousada.usa_banco()
+        pousada.realiza_reserva("Duda", date(2024, 4, 1), date(2024, 4, 2), pousada.encontra_quarto(4))
+        pousada.salva_dados()
+        pousada = self.pousada()
+        pousada.usa_banco()
+        self.assertEqual(len(pousada.consulta_reserva("Duda")), 1)
+        self.assertIsNone(pousada.reserva_se_disponivel("Eva", date(2024, 4, 1), date(2024, 4, 1), pousada.encontra_quarto(4)))
+
+    def test_salva_em_outra_thread(self):
+        pousada = self.pousada()
+        pousada.usa_banco()
+        pousada.realiza_reserva("Duda", date(2024, 4, 1), date(2024, 4, 2), pousada.encontra_quarto(4))
+        erros = []
+        def salva():
+            try:
+                pousada.salva_dados()
+            except Exception as erro:
+                erros.append(erro)
+        thread = threading.Thread(target=salva)
+        thread.start()
+        thread.join()
+        self.assertEqual(erros, [])
+        self.assertEqual(len(self.reabre().consulta_reserva("Duda")), 1)
+
+class ArquivoFixoTeste(PousadaTeste):
+    def test_carga_preguicosa_le_so_as_linhas_atuais(self):
+        self.escreve("reserva.csv", ["Ana,01-01-2020,05-01-2020,O,1", "Bia,01-01-2099,05-01-2099,A,2",
+                                     "Cris,01-01-2020,02-01-2020,C,3"])
+        self.pousada().usa_arquivo_fixo()
+        pousada = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        pousada.usa_arquivo_fixo()
+        lidas = []
+        le = ga.ArquivoReservas.le
+        def conta(arquivo, linha):
+            lidas.append(linha)
+            return le(arquivo, linha)
+        with mock.patch.object(ga.ArquivoReservas, "le", conta):
+            pousada.carrega_dados(filtro=lambda reserva: reserva.cliente != "Cris", preguicoso=True)
+            self.assertEqual(lidas, [1])
+            self.assertEqual([reserva.cliente for reserva in pousada.reservas], ["Bia", "Ana"])
+            self.assertEqual(sorted(lidas), [0, 1, 2])
+        pousada.realiza_checkin("Bia")
+        reaberta = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+        reaberta.usa_arquivo_fixo()
+        self.assertEqual([reserva.cliente for reserva in reaberta.hospedagens], ["Bia"])
+
+    def test_importa_reservas_reaplicadas_do_diario(self):
+        pousada = self.pousada()
+        pousada.abre_diario()
+        pousada.realiza_reserva("Duda", date(2024, 4, 1), date(2024, 4, 2), pousada.encontra_quarto(4))
+        pousada.registra_consumo(pousada.encontra_quarto(4), 1, 2)
+        pousada = self.pousada()
+        self.assertEqual(pousada.abre_diario(), 2)
+        pousada.usa_arquivo_fixo()
+        for _ in range(2):
+            reaberta = ga.Pousada("Teste", "teste@pousada.com", self.pasta)
+            reaberta.usa_arquivo_fixo()
+            self.assertEqual(reaberta.abre_diario(), 0)
+            self.assertEqual(len(reaberta.consulta_reserva("Duda")), 1)
+            self.assertEqual(reaberta.encontra_quarto(4).consumo, {1: 2})
+
+class LoteTeste(PousadaTeste):
+    def test_uma_reserva_ativa_por_cliente(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        quarto = pousada.encontra_quarto
+        resultados = pousada.realiza_reservas_lote([("ana", date(2024, 4, 1), date(2024, 4, 2), quarto(2)),
+                                                    ("Bia", date(2024, 4, 1), date(2024, 4, 2), quarto(4)),
+                                                    ("Bia", date(2024, 4, 5), date(2024, 4, 6), quarto(3)),
+                                                    ("Cris", date(2024, 4, 5), date(2024, 4, 6), quarto(3))])
+        self.assertEqual([motivo for _, motivo in resultados],
+                         ["Cliente já possui reserva ativa", None, "Cliente já possui reserva ativa", None])
+        self.assertEqual(len(pousada.consulta_reserva("Bia")), 1)
+
+    def test_checkin_em_grupo_exige_criterio(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Bia,01-03-2024,05-03-2024,A,2"])
+        pousada = self.pousada()
+        with self.assertRaises(ValueError):
+            pousada.realiza_checkin_lote()
+        with self.assertRaises(ValueError):
+            pousada.realiza_checkout_lote()
+        self.assertEqual(len(pousada.reservas_ativas), 2)
+        self.assertEqual(list(pousada.realiza_checkin_lote(filtro=lambda reserva: reserva.cliente == "Bia")), [2])
+
+class DiarioStatusTeste(PousadaTeste):
+    def test_reaplica_so_as_reservas_trocadas(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1", "Ana,01-03-2024,05-03-2024,A,2"])
+        pousada = self.pousada()
+        pousada.abre_diario()
+        primeira, segunda = pousada.consulta_reserva("Ana")
+        self.assertTrue(pousada.cancela_reserva("Ana", {primeira: primeira.versao}))
+        reaberta = self.pousada()
+        reaberta.abre_diario()
+        self.assertEqual([reserva.quarto.numero for reserva in reaberta.consulta_reserva("Ana")], [2])
+        self.assertEqual([reserva.quarto.numero for reserva in reaberta.reservas_por_status("C")], [1])
+
+class ConcorrenciaTeste(PousadaTeste):
+    def test_consultas_durante_reservas(self):
+        intervalo = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)     # <-- troca de thread o mais vezes possível
+        self.addCleanup(sys.setswitchinterval, intervalo)
+        pousada = self.pousada()
+        pousada.abre_diario()
+        dia = date(2030, 1, 1)
+        erros, terminou = [], threading.Event()
+
+        def reserva(numero):
+            quarto = pousada.encontra_quarto(numero)
+            for i in range(200):
+                if pousada.reserva_se_disponivel("Grupo", dia + timedelta(i), dia + timedelta(i), quarto) is None:
+                    erros.append(f"quarto {numero} ocupado no dia {i}")
+
+        def consulta():
+            while not terminou.is_set():
+                for reserva in pousada.consulta_reserva("Grupo") or []:
+                    if pousada.consulta_disponibilidade(reserva.dia_inicio, reserva.dia_fim, reserva.quarto):
+                        erros.append(f"{reserva.quarto.numero} livre em {reserva.dia_inicio}")
+                pousada.consulta_quartos_livres(dia, dia + timedelta(10))
+                pousada.reservas_por_status("A")
+                pousada.salva_dados()
+
+        def protege(funcao, *args):
+            try:
+                funcao(*args)
+            except Exception as erro:
+                erros.append(repr(erro))
+
+        leitores = [threading.Thread(target=protege, args=(consulta,)) for _ in range(2)]
+        escritores = [threading.Thread(target=protege, args=(reserva, numero)) for numero in range(1, 6)]
+        for thread in leitores + escritores:
+            thread.start()
+        for thread in escritores:
+            thread.join()
+        terminou.set()
+        for thread in leitores:
+            thread.join()
+        self.assertEqual(erros, [])
+        self.assertEqual(len(pousada.consulta_reserva("Grupo")), 1000)
+        pousada.compacta()
+        self.assertEqual(len(self.pousada().consulta_reserva("Grupo")), 1000)
+
+    def consultas_com_escrita_presa(self, pousada, objeto, nome):
+        """Prende a primeira chamada de objeto.nome no meio de uma reserva e retorna se as consultas
+        e o salva_dados terminaram enquanto ela estava presa."""
+        original = getattr(objeto, nome)
+        presa, solta = threading.Event(), threading.Event()
+
+        def prende(*args, **kwargs):
+            if not presa.is_set():
+                presa.set()
+                solta.wait(5)
+            return original(*args, **kwargs)
+
+        dia, quarto = date(2030, 1, 1), pousada.encontra_quarto(1)
+
+        def consulta():
+            pousada.consulta_reserva("Bia")
+            pousada.reservas_por_status("A")
+            pousada.consulta_quartos_livres(dia, dia)
+            pousada.consulta_disponibilidade(dia, dia, quarto)
+            pousada.salva_dados()
+
+        with mock.patch.object(objeto, nome, prende):
+            escritor = threading.Thread(target=pousada.realiza_reserva, args=("Ana", dia, dia, quarto))
+            escritor.start()
+            self.assertTrue(presa.wait(2))
+            leitor = threading.Thread(target=consulta)
+            leitor.start()
+            leitor.join(timeout=2)
+            terminou = not leitor.is_alive()
+            solta.set()
+            escritor.join()
+            leitor.join()
+        self.assertEqual(len(pousada.consulta_reserva("Ana")), 1)
+        return terminou
+
+    def test_consultas_nao_esperam_o_fsync_do_diario(self):
+        pousada = self.pousada()
+        pousada.abre_diario(lote=1)
+        self.assertTrue(self.consultas_com_escrita_presa(pousada, ga.os, "fsync"))
+
+    def test_consultas_nao_esperam_o_arquivo_fixo(self):
+        pousada = self.pousada()
+        pousada.usa_arquivo_fixo()
+        self.assertTrue(self.consultas_com_escrita_presa(pousada, ga.ArquivoReservas, "acrescenta"))
+
+def post(caminho, corpo):
+    """Retorna os bytes de um POST com o corpo (texto) informado."""
+    corpo = corpo.encode()
+    return f"POST {caminho} HTTP/1.1\r\nContent-Length: {len(corpo)}\r\n\r\n".encode() + corpo
+
+class RedeTeste(PousadaTeste):
+    def cria_pousada(self, nome, quartos):
+        """Cria a pasta de uma pousada da rede e retorna o caminho."""
+        pasta = os.path.join(self.pasta, nome)
+        os.mkdir(pasta)
+        for arquivo, linhas in [("pousada.csv", [f"{nome},{nome}@pousada.com"]), ("quarto.csv", quartos),
+                                ("produto.csv", PRODUTOS), ("reserva.csv", [])]:
+            self.escreve(os.path.join(nome, arquivo), linhas)
+        return pasta
+
+    def rede(self):
+        rede = ga.RedePousadas(max_threads=2)
+        rede.carrega([os.path.join(self.pasta, nome) for nome in ["centro", "praia"]])
+        return rede
+
+    def test_diario_de_cada_pousada(self):
+        self.cria_pousada("centro", QUARTOS)
+        self.cria_pousada("praia", QUARTOS)
+        self.escreve(os.path.join("centro", "diario.csv"), ["1,reserva,Duda,01-04-2024,02-04-2024,4"])
+        rede = self.rede()
+        self.assertEqual(len(rede.pousada("centro").consulta_reserva("Duda")), 1)
+        rede.executa("praia", "realiza_reserva", "Eva", date(2024, 4, 1), date(2024, 4, 2),
+                     rede.pousada("praia").encontra_quarto(5))
+        rede.fecha()
+        self.assertEqual(self.le(os.path.join("centro", "diario.csv")), [])
+        self.assertEqual(self.le(os.path.join("praia", "reserva.csv")), ["Eva,01-04-2024,02-04-2024,A,5"])
+        rede = self.rede()
+        self.addCleanup(rede.fecha)
+        self.assertEqual(len(rede.pousada("centro").consulta_reserva("Duda")), 1)
+        self.assertEqual(len(rede.pousada("praia").consulta_reserva("Eva")), 1)
+
+    def test_busca_em_todas_as_pousadas(self):
+        self.cria_pousada("centro", ["1,S,500.0", "2,M,800.0"])
+        self.cria_pousada("praia", ["1,S,100.0", "2,M,900.0", "3,S,600.0"])
+        rede = self.rede()
+        self.addCleanup(rede.fecha)
+        rede.executa("praia", "realiza_reserva", "Eva", date(2024, 4, 1), date(2024, 4, 2),
+                     rede.pousada("praia").encontra_quarto(3))
+        livres = rede.consulta_quartos_livres(date(2024, 4, 1), date(2024, 4, 1))
+        self.assertEqual([(id_pousada, quarto.diaria) for id_pousada, quarto in livres],
+                         [("praia", 100.0), ("centro", 500.0), ("centro", 800.0), ("praia", 900.0)])
+        livres = rede.consulta_quartos_livres(date(2024, 4, 1), date(2024, 4, 1), categoria="M")
+        self.assertEqual([(id_pousada, quarto.numero) for id_pousada, quarto in livres], [("centro", 2), ("praia", 2)])
+
+class ServidorTeste(PousadaTeste):
+    def conversa(self, pousada, *requisicoes):
+        """Envia as requisições numa mesma conexão com o servidor e retorna os status HTTP
+        recebidos, parando se o servidor fechar a conexão."""
+        async def conversa():
+            with socket.socket() as livre:
+                livre.bind(("127.0.0.1", 0))
+                porta = livre.getsockname()[1]
+            tarefa = asyncio.create_task(ga.ServidorPousada(pousada).executa(porta=porta))
+            for _ in range(200):
+                try:
+                    reader, writer = await asyncio.open_connection("127.0.0.1", porta)
+                    break
+                except OSError:
+                    await asyncio.sleep(0.01)
+            status = []
+            for requisicao in requisicoes:
+                writer.write(requisicao)
+                linha = await reader.readline()
+                if not linha:
+                    break
+                cabecalhos = {}
+                while (cabecalho := await reader.readline()) != b"\r\n":
+                    nome, _, valor = cabecalho.decode().partition(":")
+                    cabecalhos[nome.lower()] = valor.strip()
+                json.loads(await reader.readexactly(int(cabecalhos["content-length"])))
+                status.append(int(linha.split()[1]))
+            writer.close()
+            tarefa.cancel()
+            return status
+        return asyncio.run(conversa())
+
+    def test_corpo_invalido(self):
+        pousada = self.pousada()
+        status = self.conversa(pousada, post("/checkin", "[1]"), post("/checkin", "{nao e json"),
+                               post("/reservas", '{"cliente": 7, "inicio": "01-03-2024", "fim": "02-03-2024", "quarto": 1}'),
+                               post("/reservas/lote", '{"pedidos": [1]}'),
+                               post("/checkin/lote", '{"clientes": "Ana"}'),
+                               post("/reservas", '{"cliente": "Ana", "inicio": "01-03-2024", "fim": "02-03-2024", "quarto": 1}'))
+        self.assertEqual(status, [400, 400, 400, 400, 400, 201])
+
+    def test_reserva_com_fim_antes_do_inicio(self):
+        pousada = self.pousada()
+        status = self.conversa(pousada, post("/reservas", '{"cliente": "Ana", "inicio": "05-03-2024", "fim": "01-03-2024", "quarto": 1}'))
+        self.assertEqual(status, [400])
+        self.assertIsNone(pousada.consulta_reserva("Ana"))
+
+    def test_alteracoes_fora_da_thread_do_servidor(self):
+        pousada = self.pousada()
+        threads = []
+        realiza_reserva = pousada.realiza_reserva
+        def registra_thread(*args):
+            threads.append(threading.get_ident())
+            return realiza_reserva(*args)
+        with mock.patch.object(pousada, "realiza_reserva", registra_thread):
+            status = self.conversa(pousada, post("/reservas", '{"cliente": "Ana", "inicio": "01-03-2024", "fim": "02-03-2024", "quarto": 1}'))
+        self.assertEqual(status, [201])
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_lote_sem_criterio(self):
+        self.escreve("reserva.csv", ["Ana,01-03-2024,05-03-2024,A,1"])
+        pousada = self.pousada()
+        self.assertEqual(self.conversa(pousada, post("/checkin/lote", "{}"), post("/checkout/lote", '{"clientes": []}'),
+                                       post("/checkin/lote", '{"quartos": [1]}')), [400, 400, 200])
+        self.assertEqual(len(pousada.hospedagens), 1)
+
+    def test_requisicao_mal_formada_fecha_a_conexao(self):
+        pousada = self.pousada()
+        requisicao = b"POST /checkin HTTP/1.1\r\nContent-Length: abc\r\n\r\n"
+        self.assertEqual(self.conversa(pousada, requisicao, post("/checkin", "{}")), [400])
+        self.assertEqual(self.conversa(pousada, b"LIXO\r\n\r\n", post("/checkin", "{}")), [400])
+
+    def test_erro_inesperado(self):
+        pousada = self.pousada()
+        requisicao = b"GET /disponibilidade?inicio=01-03-2024&fim=02-03-2024&quarto=1 HTTP/1.1\r\n\r\n"
+        with mock.patch.object(pousada, "consulta_disponibilidade", side_effect=RuntimeError("falha")):
+            self.assertEqual(self.conversa(pousada, requisicao, requisicao), [500, 500])
+
+if __name__ == "__main__":
+    unittest.main()